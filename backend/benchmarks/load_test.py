@@ -0,0 +1,347 @@
+"""
+Load test of the request flows of the mobile app.
+
+Seeds the backend through its own API (users and garments in batches, animations
+as authenticated uploads with distinct GridFS assets), then replays every flow
+with a number of concurrent clients and reports throughput and p50/p95/p99
+latency per endpoint:
+
+- GET  /health
+- GET  /explore/animations, paged with the returned cursor
+- GET  /animations/{id}
+- GET  /animations/{id}/animation          (file download)
+- GET  /animations/{id}/thumbnail?size=small
+- POST /animations/                        (authenticated upload)
+
+Results are saved as JSON together with the current commit, so a later run can
+be compared against them. Seeded data is not removed, use a disposable database.
+
+Against a running server:
+    python benchmarks/load_test.py --url http://localhost:8000 --output results/main.json
+In process, the app is called through ASGI without a server (MongoDB from MONGO_URI is still used):
+    python benchmarks/load_test.py --in-process --compare results/main.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from io import BytesIO
+
+import httpx
+from PIL import Image
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Largest batch accepted by POST /users/batch and POST /users/{id}/garments/batch
+BATCH_SIZE = 1000
+
+
+def percentile(sorted_values, share: float) -> float:
+    # Nearest rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(share * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def jpeg(seed: int, size: int = 512) -> bytes:
+    image = Image.new("RGB", (size, size), ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@asynccontextmanager
+async def open_client(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if not args.in_process:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+            yield client
+        return
+
+    sys.path.insert(0, BACKEND_DIR)
+    from src.main import app
+
+    # ASGITransport does not run the lifespan, startup and shutdown are run here
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=args.timeout) as client:
+            yield client
+
+
+def checked(response: httpx.Response) -> httpx.Response:
+    response.raise_for_status()
+    return response
+
+
+async def seed(client: httpx.AsyncClient, args):
+    """
+    Creates the users, their garments and the animations the flows read.
+    Returns [(user id, token)] and the animation ids.
+    """
+    run = uuid.uuid4().hex[:8]
+    users = []
+    for start in range(0, args.users, BATCH_SIZE):
+        batch = [
+            {"name": f"load-{run}-{i}", "description": "load test user"}
+            for i in range(start, min(start + BATCH_SIZE, args.users))
+        ]
+        results = checked(await client.post("/users/batch", json=batch)).json()["results"]
+        users += [(result["id"], result["token"]) for result in results if not result.get("error")]
+    if not users:
+        raise RuntimeError("No users could be created")
+
+    async def add_garments(user_id):
+        garments = [{"name": f"garment-{i}", "uid": f"{run}-{user_id}-{i}"} for i in range(args.garments)]
+        checked(await client.post(f"/users/{user_id}/garments/batch", json=garments))
+
+    async def add_animation(index):
+        user_id, token = users[index % len(users)]
+        response = checked(await client.post(
+            "/animations/",
+            data={
+                "animation_name": f"load-{run}-{index}",
+                "animation_description": "load test animation",
+                "is_public": "true",
+                "physical_width": 20,
+                "physical_height": 30,
+            },
+            files={
+                # Random content, identical files would be stored only once
+                "file": (f"animation-{index}.bin", os.urandom(args.asset_size), "application/octet-stream"),
+                "thumbnail": (f"thumbnail-{index}.jpg", jpeg(index), "image/jpeg"),
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        ))
+        return response.json()["id"]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    if args.garments:
+        await asyncio.gather(*(limited(add_garments(user_id)) for user_id, _ in users))
+    animation_ids = await asyncio.gather(*(limited(add_animation(i)) for i in range(args.animations)))
+    return users, list(animation_ids)
+
+
+def make_flows(users, animation_ids, args):
+    """
+    {endpoint: operation}, every operation makes one or more requests through
+    `request(endpoint, method, url, **kwargs)` so each of them is timed.
+    """
+    upload_file = os.urandom(args.asset_size)
+    upload_thumbnail = jpeg(0)
+
+    async def health(request):
+        await request("GET /health", "GET", "/health")
+
+    async def explore(request):
+        # One app session scrolling through the feed
+        cursor = ""
+        for _ in range(args.pages):
+            page = await request(
+                "GET /explore/animations", "GET", "/explore/animations",
+                params={"limit": args.page_size, "cursor": cursor},
+            )
+            cursor = page.json()["pagination"]["next_cursor"]
+            if not cursor:
+                break
+
+    async def metadata(request):
+        animation_id = random.choice(animation_ids)
+        await request("GET /animations/{id}", "GET", f"/animations/{animation_id}")
+
+    async def download(request):
+        animation_id = random.choice(animation_ids)
+        await request("GET /animations/{id}/animation", "GET", f"/animations/{animation_id}/animation")
+
+    async def thumbnail(request):
+        animation_id = random.choice(animation_ids)
+        await request(
+            "GET /animations/{id}/thumbnail", "GET", f"/animations/{animation_id}/thumbnail", params={"size": "small"}
+        )
+
+    async def upload(request):
+        _, token = random.choice(users)
+        await request(
+            "POST /animations/", "POST", "/animations/",
+            data={
+                "animation_name": "load test upload",
+                "animation_description": "load test animation",
+                "is_public": "true",
+                "physical_width": 20,
+                "physical_height": 30,
+            },
+            files={
+                "file": ("upload.bin", upload_file, "application/octet-stream"),
+                "thumbnail": ("upload.jpg", upload_thumbnail, "image/jpeg"),
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    return {
+        "health": health,
+        "explore": explore,
+        "metadata": metadata,
+        "download": download,
+        "thumbnail": thumbnail,
+        "upload": upload,
+    }
+
+
+async def run_flow(client: httpx.AsyncClient, operation, operations: int, concurrency: int):
+    """
+    Runs `operations` operations on `concurrency` clients.
+    Returns the latencies and error count per endpoint and the elapsed time.
+    """
+    latencies = {}
+    errors = {}
+
+    async def request(endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            errors[endpoint] = errors.get(endpoint, 0) + 1
+            raise
+        finally:
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        return response
+
+    remaining = iter(range(operations))
+
+    async def worker():
+        for _ in remaining:
+            try:
+                await operation(request)
+            except httpx.HTTPError:
+                pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def summarize(latencies, errors, elapsed: float):
+    results = {}
+    for endpoint, values in latencies.items():
+        values.sort()
+        results[endpoint] = {
+            "requests": len(values),
+            "errors": errors.get(endpoint, 0),
+            "throughput": len(values) / elapsed,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    return results
+
+
+def print_results(results, baseline=None):
+    print(f"{'endpoint':<32} {'req':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  {'p95 vs baseline':>15}")
+    for endpoint, result in results.items():
+        change = ""
+        previous = (baseline or {}).get(endpoint)
+        if previous and previous["p95_ms"]:
+            change = f"{(result['p95_ms'] / previous['p95_ms'] - 1) * 100:+.0f}%"
+        print(
+            f"{endpoint:<32} {result['requests']:>6} {result['errors']:>4} {result['throughput']:>8.1f} "
+            f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}  {change:>15}"
+        )
+
+
+def regressions(results, baseline, threshold: float):
+    # Endpoints whose p95 got slower than the baseline by more than `threshold` (0.2 = 20 %)
+    return [
+        endpoint for endpoint, result in results.items()
+        if endpoint in baseline and result["p95_ms"] > baseline[endpoint]["p95_ms"] * (1 + threshold)
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default=os.getenv("LOAD_TEST_URL", "http://localhost:8000"))
+    target.add_argument("--in-process", action="store_true", help="call the app through ASGI instead of a server")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--garments", type=int, default=2, help="garments per user")
+    parser.add_argument("--animations", type=int, default=200)
+    parser.add_argument("--asset-size", type=int, default=256 * 1024, help="bytes of every uploaded animation file")
+    parser.add_argument("--flows", nargs="+", default=["health", "explore", "metadata", "download", "thumbnail", "upload"])
+    parser.add_argument("--operations", type=int, default=500, help="operations per flow")
+    parser.add_argument("--warmup", type=int, default=50, help="operations per flow before measuring")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5, help="explore pages per session")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random choices")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="p95 slowdown against --compare reported as a regression, exits with status 1")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    async with open_client(args) as client:
+        start = time.perf_counter()
+        users, animation_ids = await seed(client, args)
+        print(f"Seeded {len(users)} users, {len(animation_ids)} animations in {time.perf_counter() - start:.1f}s")
+
+        flows = make_flows(users, animation_ids, args)
+        results = {}
+        for name in args.flows:
+            if args.warmup:
+                await run_flow(client, flows[name], args.warmup, args.concurrency)
+            results.update(summarize(*await run_flow(client, flows[name], args.operations, args.concurrency)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+        baseline = previous["results"]
+        print(f"Baseline: commit {previous['commit']} from {previous['created_at']}")
+    print_results(results, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump({
+                "commit": current_commit(),
+                "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                "target": "in-process" if args.in_process else args.url,
+                "config": vars(args),
+                "results": results,
+            }, file, indent=2)
+        print(f"Saved to {args.output}")
+
+    if baseline and (slower := regressions(results, baseline, args.threshold)):
+        print(f"p95 regressed by more than {args.threshold:.0%}: {', '.join(slower)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,147 @@
+"""
+Compares the time to build and serialize large list responses:
+
+- before: request.url_for twice per item, then FastAPI validates the list against
+  the route's response_model and renders it with the standard JSONResponse
+- after: link templates resolved once and filled with str.format, the list is
+  rendered with orjson (FastJSONResponse) without validating it again
+
+No database is needed, the rows look like the repository output of GET /users/
+and GET /animations/.
+    python benchmarks/serialization_benchmark.py --rows 10000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from starlette.requests import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.main import app  # noqa: E402
+from src.models.user import UserResponse  # noqa: E402
+from src.schemas.animation_schemas import AnimationResponse  # noqa: E402
+from src.utils.fast_responses import FastJSONResponse, link_template, model_defaults  # noqa: E402
+
+
+def make_request() -> Request:
+    return Request({
+        "type": "http", "app": app, "router": app.router, "scheme": "http", "server": ("localhost", 80),
+        "path": "/", "root_path": "", "headers": [(b"host", b"localhost")], "query_string": b"",
+    })
+
+
+def make_users(rows: int):
+    return [
+        {
+            "id": str(ObjectId()), "name": f"user-{i}", "description": "benchmark user", "joinedDate": "01/01/2025",
+            "avatarFileId": str(ObjectId()),
+            "garments": [{"id": str(ObjectId()), "name": "shirt", "uid": f"uid-{i}", "animationId": None}],
+        }
+        for i in range(rows)
+    ]
+
+
+def make_animations(rows: int):
+    return [
+        {
+            "id": str(ObjectId()), "animationName": f"animation-{i}", "animationDescription": "benchmark",
+            "isPublic": True, "physicalWidth": 20, "physicalHeight": 30, "author_id": str(ObjectId()),
+            "animationFileId": str(ObjectId()), "created_at": "01/01/2025",
+        }
+        for i in range(rows)
+    ]
+
+
+def response_field(response_model):
+    # The field FastAPI validates and serializes a route's return value with
+    return APIRoute("/", endpoint=lambda: None, response_model=response_model).response_field
+
+
+async def users_before(request, users, field):
+    for user in users:
+        url = str(request.url_for("get_user_avatar", user_id=user["id"]))
+        user["avatarUrl"] = f"{url}?v={user.pop('avatarFileId')}"
+        user["links"] = [
+            {"rel": "self", "href": str(request.url_for("get_user", user_id=user["id"]))},
+            {"rel": "garments", "href": str(request.url_for("get_user_garments", user_id=user["id"]))},
+        ]
+    content = await serialize_response(field=field, response_content=users)
+    return JSONResponse(content).body
+
+
+async def users_after(request, users, _):
+    defaults = model_defaults(UserResponse)
+    avatar_link = link_template(request, "get_user_avatar", "user_id")
+    self_link = link_template(request, "get_user", "user_id")
+    garments_link = link_template(request, "get_user_garments", "user_id")
+    for index, user in enumerate(users):
+        user["avatarUrl"] = f"{avatar_link.format(user_id=user['id'])}?v={user.pop('avatarFileId')}"
+        user["links"] = [
+            {"rel": "self", "href": self_link.format(user_id=user["id"])},
+            {"rel": "garments", "href": garments_link.format(user_id=user["id"])},
+        ]
+        users[index] = {**defaults, **user}
+    return FastJSONResponse(users).body
+
+
+async def animations_before(request, animations, field):
+    for animation in animations:
+        animation["links"] = [
+            {"rel": "self", "href": str(request.url_for("get_animation", animation_id=animation["id"]))},
+            {"rel": "file", "href": str(request.url_for("get_animation_file", animation_id=animation["id"]))},
+        ]
+    content = await serialize_response(field=field, response_content=animations)
+    return JSONResponse(content).body
+
+
+async def animations_after(request, animations, _):
+    defaults = model_defaults(AnimationResponse)
+    self_link = link_template(request, "get_animation", "animation_id")
+    file_link = link_template(request, "get_animation_file", "animation_id")
+    for index, animation in enumerate(animations):
+        animation["links"] = [
+            {"rel": "self", "href": self_link.format(animation_id=animation["id"])},
+            {"rel": "file", "href": file_link.format(animation_id=animation["id"])},
+        ]
+        animations[index] = {**defaults, **animation}
+    return FastJSONResponse(animations).body
+
+
+async def best_of(repeat: int, function, request, make_rows, rows: int, field):
+    timings = []
+    for _ in range(repeat):
+        data = make_rows(rows)
+        start = time.perf_counter()
+        body = await function(request, data, field)
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(body)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    request = make_request()
+    cases = [
+        ("GET /users/", make_users, List[UserResponse], users_before, users_after),
+        ("GET /animations/", make_animations, List[AnimationResponse], animations_before, animations_after),
+    ]
+    print(f"{'endpoint':<18} {'before':>10} {'after':>10} {'speedup':>8} {'body':>10}")
+    for label, make_rows, response_model, before, after in cases:
+        field = response_field(response_model)
+        before_time, _ = await best_of(args.repeat, before, request, make_rows, args.rows, field)
+        after_time, size = await best_of(args.repeat, after, request, make_rows, args.rows, field)
+        print(f"{label:<18} {before_time * 1000:>8.1f}ms {after_time * 1000:>8.1f}ms "
+              f"{before_time / after_time:>7.1f}x {size / 1024:>8.0f}KB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,12 +7,18 @@ def create_mock_users():
         {"name": "Charlie", "email": "charlie@example.com"}
     ]
     
-    for user in users:
-        response = requests.post("http://localhost:80/users/", json=user)
-        if response.status_code == 200:
-            print(f"User {user['name']} added successfully.")
+    # One request for all users, the response reports every user separately
+    response = requests.post("http://localhost:80/users/batch", json=users)
+    if response.status_code != 200:
+        print(f"Failed to add users: {response.status_code}")
+        return
+
+    for result in response.json()["results"]:
+        user = users[result["index"]]
+        if result.get("error"):
+            print(f"Failed to add {user['name']}: {result['error']}")
         else:
-            print(f"Failed to add {user['name']}.")
+            print(f"User {user['name']} added successfully.")
 
 if __name__ == "__main__":
     create_mock_users()
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Form, HTTPException, UploadFile, File, Depends, Request
-from fastapi.responses import StreamingResponse
-from typing import Annotated, List
-from ..schemas.animation_schemas import AnimationCreate, AnimationResponse
-from ..repositories.animation_repository import AnimationRepository
+from fastapi import APIRouter, BackgroundTasks, Form, HTTPException, UploadFile, File, Depends, Query, Request
+from typing import Annotated, List, Optional
+from gridfs.errors import NoFile
+from ..schemas.animation_schemas import (
+    AnimationBatchGetRequest, AnimationBatchGetResponse, AnimationCreate, AnimationResponse, AnimationStatus,
+    AnimationSummary
+)
+from ..repositories.animation_repository import AnimationRepository, ANIMATION_LIST_FIELDS, ANIMATION_SUMMARY_FIELDS
+from ..repositories.file_repository import FileRepository, UploadTooLarge
+from ..repositories.job_repository import ConversionJobRepository, conversion_kind, DONE
 from ..utils.dependencies import get_current_user
-from io import BytesIO
+from ..utils.file_responses import gridfs_file_response
+from ..services.thumbnail_service import ThumbnailService, THUMBNAIL_SIZES
+from ..core.response_cache import response_cache
+from ..utils.fast_responses import FastJSONResponse, link_template, model_defaults, ndjson_response, wants_ndjson
 
 router = APIRouter()
 
@@ -17,6 +25,7 @@ async def create_animation(
     physical_height: Annotated[int, Form()],
     # thumbnail: Annotated[str, Form()],
     request: Request,
+    background_tasks: BackgroundTasks,
     thumbnail: UploadFile = File(...),
     file: UploadFile = File(...),
     user = Depends(get_current_user),
@@ -31,9 +40,13 @@ async def create_animation(
             physicalHeight=physical_height
         )
 
-        # Save file
-        file_id = await AnimationRepository.save_file_to_gridfs(file)
-        thumbnail_id = await AnimationRepository.save_file_to_gridfs(thumbnail)
+        # Save file, identical content is stored only once
+        file_id = await FileRepository.save_file_to_gridfs(file)
+        try:
+            thumbnail_id = await FileRepository.save_file_to_gridfs(thumbnail)
+        except UploadTooLarge:
+            await FileRepository.release_file(file_id)
+            raise
 
         # Save animation metadata
         animation_data = animation.model_dump()
@@ -42,44 +55,111 @@ async def create_animation(
         # animation_data["thumbnail"] = thumbnail
         animation_data["thumbnailFileId"] = str(thumbnail_id)
 
-        created_animation = AnimationRepository.create_animation(animation_data)
+        # Heavy conversions run in the usdz_conversion worker, the upload only queues them
+        kind = conversion_kind(file.content_type, file.filename)
+        if kind:
+            animation_data["conversionJobId"] = str(await ConversionJobRepository.enqueue(file_id, kind))
+
+        created_animation = await AnimationRepository.create_animation(animation_data)
+        # Resized thumbnails for the explore grid are rendered after the response is sent
+        background_tasks.add_task(ThumbnailService.prerender, thumbnail_id)
         
         # Add HATEOAS links
         created_animation['links'] = [
             {"rel": "self", "href": str(request.url_for("get_animation", animation_id=created_animation['id']))},
-            {"rel": "file", "href": str(request.url_for("get_animation_file", animation_id=created_animation['id']))}
+            {"rel": "file", "href": str(request.url_for("get_animation_file", animation_id=created_animation['id']))},
+            {"rel": "status", "href": str(request.url_for("get_animation_status", animation_id=created_animation['id']))}
         ]
         
         return created_animation
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
+def animation_list_item(request: Request):
+    # Returns the converter of a repository animation to its list item, links are resolved once
+    defaults = model_defaults(AnimationResponse)
+    self_link = link_template(request, "get_animation", "animation_id")
+    file_link = link_template(request, "get_animation_file", "animation_id")
+
+    def to_item(animation: dict) -> dict:
+        animation['links'] = [
+            {"rel": "self", "href": self_link.format(animation_id=animation['id'])},
+            {"rel": "file", "href": file_link.format(animation_id=animation['id'])}
+        ]
+        return {**defaults, **animation}
+    return to_item
+
+
 @router.get("/", response_model=List[AnimationResponse])
-async def get_animations(request: Request):
-    animations = AnimationRepository.get_all_animations()
-    for animation in animations:
+async def get_animations(
+    request: Request,
+    stream: bool = Query(False, description="Stream all animations as NDJSON, same as Accept: application/x-ndjson")
+):
+    # Only the documented fields are loaded, so the list is sent without validating it again
+    to_item = animation_list_item(request)
+    if wants_ndjson(request, stream):
+        return ndjson_response(AnimationRepository.iter_all_animations(fields=ANIMATION_LIST_FIELDS), to_item)
+    animations = await AnimationRepository.get_all_animations(fields=ANIMATION_LIST_FIELDS)
+    return FastJSONResponse([to_item(animation) for animation in animations])
+
+# Declared before /{animation_id} so it is not taken for an animation id
+@router.get("/summary", response_model=List[AnimationSummary])
+async def get_animations_summary(
+    request: Request,
+    limit: int = Query(10, description="Number of animations to retrieve"),
+    offset: int = Query(0, description="Offset for pagination")
+):
+    animations = await AnimationRepository.get_all_animations(limit=limit, offset=offset, fields=ANIMATION_SUMMARY_FIELDS)
+    defaults = model_defaults(AnimationSummary)
+    self_link = link_template(request, "get_animation", "animation_id")
+    thumbnail_link = link_template(request, "get_animation_thumbnail", "animation_id")
+    for index, animation in enumerate(animations):
         animation['links'] = [
-            {"rel": "self", "href": str(request.url_for("get_animation", animation_id=animation['id']))},
-            {"rel": "file", "href": str(request.url_for("get_animation_file", animation_id=animation['id']))}
+            {"rel": "self", "href": self_link.format(animation_id=animation['id'])},
+            {"rel": "thumbnail", "href": thumbnail_link.format(animation_id=animation['id'])}
         ]
-    return animations
+        animations[index] = {**defaults, **animation}
+    return FastJSONResponse(animations)
+
+# Most ids one batch-get may ask for
+BATCH_GET_MAX_IDS = 100
+
+@router.post("/batch-get", response_model=AnimationBatchGetResponse)
+async def batch_get_animations(body: AnimationBatchGetRequest, request: Request):
+    # Many animations in one request and one query, in the order of the requested ids
+    if len(body.ids) > BATCH_GET_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_GET_MAX_IDS} ids per request")
+    found = await AnimationRepository.get_animations_by_ids(body.ids, fields=ANIMATION_LIST_FIELDS)
+    to_item = animation_list_item(request)
+    return FastJSONResponse({
+        "animations": [to_item(dict(found[animation_id])) for animation_id in body.ids if animation_id in found],
+        "missing": [animation_id for animation_id in body.ids if animation_id not in found]
+    })
 
 @router.get("/{animation_id}", response_model=AnimationResponse)
 async def get_animation(animation_id: str, request: Request):
-    animation = AnimationRepository.get_animation_by_id(animation_id)
-    if not animation:
-        raise HTTPException(status_code=404, detail="Animation not found")
-    
-    animation['links'] = [
-        {"rel": "self", "href": str(request.url_for("get_animation", animation_id=animation_id))},
-        {"rel": "file", "href": str(request.url_for("get_animation_file", animation_id=animation_id))}
-    ]
-    return animation
+    async def build():
+        animation = await AnimationRepository.get_animation_by_id(animation_id)
+        if not animation:
+            raise HTTPException(status_code=404, detail="Animation not found")
+
+        animation['links'] = [
+            {"rel": "self", "href": str(request.url_for("get_animation", animation_id=animation_id))},
+            {"rel": "file", "href": str(request.url_for("get_animation_file", animation_id=animation_id))}
+        ]
+        return animation
+
+    response = await response_cache.respond(request, ["animation", f"animation:{animation_id}"], build, AnimationResponse)
+    # Counted after the animation was found, cached responses included
+    AnimationRepository.record_view(animation_id)
+    return response
 
 @router.get("/{animation_id}/animation")
-async def get_animation_file(animation_id: str):
-    animation = AnimationRepository.get_animation_by_id(animation_id)
+async def get_animation_file(animation_id: str, request: Request):
+    animation = await AnimationRepository.get_animation_by_id(animation_id)
     if not animation:
         raise HTTPException(status_code=404, detail="Animation not found")
     
@@ -89,25 +169,86 @@ async def get_animation_file(animation_id: str):
     
     try:
         # Retrieve the file from GridFS
-        grid_out = await AnimationRepository.get_animation_file(file_id)
+        grid_out = await FileRepository.get_file(file_id)
+    except NoFile:
+        grid_out = None
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error retrieving the file")
     
     if not grid_out:
         raise HTTPException(status_code=404, detail="File not found in storage")
-    
-    file_stream = BytesIO(grid_out.read())
-    return StreamingResponse(
-        file_stream,
-        media_type=grid_out.content_type or "application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename={grid_out.filename}"
-        }
+
+    # Streamed chunk by chunk, supports Range and If-None-Match
+    response = gridfs_file_response(
+        request,
+        grid_out,
+        media_type=FileRepository.get_content_type(grid_out) or "application/octet-stream",
     )
 
+    # Only responses with the whole file are downloads, not probes (bytes=0-1), resumes or 304s
+    length = grid_out.length
+    if response.status_code == 200 or (
+        response.status_code == 206 and response.headers.get("content-range") == f"bytes 0-{length - 1}/{length}"
+    ):
+        AnimationRepository.record_download(animation_id)
+    return response
+
+# Files the conversion worker produces, see usdz_conversion/converters.py
+CONVERTED_OUTPUTS = ("video", "poster", "model")
+
+@router.get("/{animation_id}/status", response_model=AnimationStatus)
+async def get_animation_status(animation_id: str, request: Request):
+    # Polled by the app after an upload until the conversion is done
+    animation = await AnimationRepository.get_animation_by_id(animation_id, fields=("conversionJobId",))
+    if not animation:
+        raise HTTPException(status_code=404, detail="Animation not found")
+    if not animation.get("conversionJobId"):
+        return {"animation_id": animation_id, "status": "ready", "progress": 100}
+
+    job = await ConversionJobRepository.get_job(animation["conversionJobId"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Conversion job not found")
+    links = [
+        {"rel": output, "href": str(request.url_for("get_converted_file", animation_id=animation_id, output=output))}
+        for output in (job.get("outputs") or {}) if job["status"] == DONE
+    ]
+    return {
+        "animation_id": animation_id,
+        "status": job["status"],
+        "progress": job.get("progress", 0),
+        "error": job.get("error"),
+        "links": links
+    }
+
+@router.get("/{animation_id}/converted/{output}")
+async def get_converted_file(animation_id: str, output: str, request: Request):
+    if output not in CONVERTED_OUTPUTS:
+        raise HTTPException(status_code=404, detail="Unknown output")
+    animation = await AnimationRepository.get_animation_by_id(animation_id, fields=("conversionJobId",))
+    job = await ConversionJobRepository.get_job(animation["conversionJobId"]) if animation and animation.get("conversionJobId") else None
+    if not job or job["status"] != DONE:
+        raise HTTPException(status_code=404, detail="Converted file not found")
+
+    # Outputs are derivatives of the job's source, shared by all uploads of the same content
+    file_id = await FileRepository.get_derivative_id(job["sourceFileId"], output)
+    try:
+        grid_out = await FileRepository.get_file(file_id) if file_id else None
+    except NoFile:
+        grid_out = None
+    if not grid_out:
+        raise HTTPException(status_code=404, detail="Converted file not found")
+    return gridfs_file_response(request, grid_out, media_type=FileRepository.get_content_type(grid_out))
+
 @router.get("/{animation_id}/thumbnail")
-async def get_animation_thumbnail(animation_id: str):
-    animation = AnimationRepository.get_animation_by_id(animation_id)
+async def get_animation_thumbnail(
+    animation_id: str,
+    request: Request,
+    size: Optional[str] = Query(None, description=f"Resized variant, one of {', '.join(THUMBNAIL_SIZES)}. The original when omitted")
+):
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown thumbnail size, expected one of {', '.join(THUMBNAIL_SIZES)}")
+
+    animation = await AnimationRepository.get_animation_by_id(animation_id)
     if not animation:
         raise HTTPException(status_code=404, detail="Animation not found")
     
@@ -117,22 +258,31 @@ async def get_animation_thumbnail(animation_id: str):
     
     try:
         # Retrieve the file from GridFS
-        grid_out = await AnimationRepository.get_animation_file(file_id)
+        grid_out = await FileRepository.get_file(file_id)
+    except NoFile:
+        grid_out = None
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error retrieving the file")
     
     if not grid_out:
         raise HTTPException(status_code=404, detail="File not found in storage")
+
+    headers = None
+    if size:
+        # Format depends on the Accept header, falls back to the original for non images
+        derivative_id = await ThumbnailService.get_derivative_id(grid_out, size, request.headers.get("accept"))
+        if derivative_id:
+            grid_out = await FileRepository.get_file(derivative_id)
+        headers = {"Vary": "Accept"}
     
-    file_stream = BytesIO(grid_out.read())
-    return StreamingResponse(
-        file_stream,
-        media_type=grid_out.content_type or "application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename={grid_out.filename}"
-        }
+    # Streamed chunk by chunk, supports Range and If-None-Match
+    return gridfs_file_response(
+        request,
+        grid_out,
+        media_type=FileRepository.get_content_type(grid_out) or "application/octet-stream",
+        headers=headers,
     )
 
 @router.delete("/", response_model=bool)
 async def delete_all_animations():
-    return AnimationRepository.delete_all_animations()
\ No newline at end of file
+    return await AnimationRepository.delete_all_animations()
\ No newline at end of file
@@ -1,41 +1,128 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from typing import List, Optional
-from ..repositories.animation_repository import AnimationRepository
-from ..repositories.user_repository import UserRepository
+from ..repositories.animation_repository import AnimationRepository, name_index as animation_name_index
+from ..repositories.user_repository import UserRepository, name_index as user_name_index
 from ..models.user import UserResponse
 from ..schemas.animation_schemas import AnimationResponse
+from ..repositories.feed_repository import FeedRepository
+from ..utils.fast_responses import link_template
+from ..utils.pagination import decode_rank_cursor, encode_rank_cursor
+from ..core.response_cache import response_cache
+from .users import avatar_url
 
 router = APIRouter()
 
+# Most results of one feed page, search or autocomplete request
+SEARCH_MAX_LIMIT = 50
+
+# Thumbnail variant linked from feed items
+FEED_THUMBNAIL_SIZE = "medium"
+
+# Animation fields used by a feed item
+EXPLORE_FIELDS = ("animationName", "author_id", "created_at", "physicalWidth", "physicalHeight", "thumbnail")
+
+async def feed_items(request: Request, animations: list) -> list:
+    # One query for all authors on the page instead of two per animation
+    authors = await UserRepository.get_authors_by_ids(
+        animation["author_id"] for animation in animations if animation.get("author_id")
+    )
+    return [
+        {
+            "animation_id": animation["id"],
+            "thumbnail": animation.get("thumbnail", ""),
+            "animation_name": animation.get("animationName", ""),
+
+            "author_id": animation.get("author_id", ""),
+            "author_name": authors.get(animation.get("author_id"), {}).get("name", ""),
+            "author_profile_image": avatar_url(request, {"id": animation["author_id"], **authors.get(animation["author_id"], {})}) if animation.get("author_id") else "",
+            "description": animation.get("animationName", ""),
+            "created_at": animation.get("created_at", ""),
+            "physical_width": animation.get("physicalWidth", ""),
+            "physical_height": animation.get("physicalHeight", ""),
+        }
+        for animation in animations
+    ]
+
+def feed_entry_items(request: Request, entries: list) -> list:
+    # Same items as feed_items, built from feed entries that already carry their author
+    thumbnail_link = link_template(request, "get_animation_thumbnail", "animation_id")
+    items = []
+    for entry in entries:
+        author_id = entry.get("author_id", "")
+        thumbnail = entry.get("thumbnail", "")
+        if entry.get("thumbnailFileId"):
+            thumbnail = f"{thumbnail_link.format(animation_id=entry['id'])}?size={FEED_THUMBNAIL_SIZE}"
+        items.append({
+            "animation_id": entry["id"],
+            "thumbnail": thumbnail,
+            "animation_name": entry.get("animationName", ""),
+
+            "author_id": author_id,
+            "author_name": entry.get("author_name", ""),
+            "author_profile_image": avatar_url(request, {"id": author_id, "avatarFileId": entry.get("author_avatar_file_id")}) if author_id else "",
+            "description": entry.get("animationName", ""),
+            "created_at": entry.get("created_at", ""),
+            "physical_width": entry.get("physicalWidth", ""),
+            "physical_height": entry.get("physicalHeight", ""),
+            "downloads": entry.get("downloads", 0),
+        })
+    return items
+
 @router.get("/animations", response_model=dict)
 async def get_animations_for_explore(
-    limit: Optional[int] = Query(10, description="Number of animations to retrieve per request"),
-    offset: Optional[int] = Query(0, description="Offset for pagination")
+    request: Request,
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT, description="Number of animations to retrieve per request"),
+    offset: int = Query(0, ge=0, description="Offset for pagination"),
+    cursor: Optional[str] = Query(None, description="Cursor pagination, empty for the first page, then the returned next_cursor")
 ):
-    animations = AnimationRepository.get_all_animations(limit=limit, offset=offset)
-    total_count = AnimationRepository.get_total_count()
-
-    response = {
-        "animations": [
-            {
-                "animation_id": animation["id"],
-                "thumbnail": animation.get("thumbnail", ""),
-                "animation_name": animation.get("animationName", ""),
-
-                "author_id": animation.get("author_id", ""),
-                "author_name": UserRepository.get_user_by_id(animation["author_id"]).get("name", ""),
-                "author_profile_image": UserRepository.get_user_by_id(animation["author_id"]).get("imageBase64", ""),
-                "description": animation.get("animationName", ""),
-                "created_at": animation.get("created_at", ""),
-                "physical_width": animation.get("physicalWidth", ""),
-                "physical_height": animation.get("physicalHeight", ""),
+    async def build():
+        try:
+            after = decode_rank_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Offset pagination is kept for older app builds, newer ones send the cursor
+        entries, has_more = await FeedRepository.get_page(limit=limit, after=after, offset=0 if cursor is not None else offset)
+        next_cursor = None
+        if cursor is not None and has_more:
+            next_cursor = encode_rank_cursor(entries[-1]["rank"], entries[-1]["id"])
+
+        return {
+            "animations": feed_entry_items(request, entries),
+            "pagination": {
+                "limit": limit,
+                "offset": offset,
+                "total_count": await FeedRepository.get_total_count(),
+                "next_cursor": next_cursor
             }
-            for animation in animations
-        ],
-        "pagination": {
-            "limit": limit,
-            "offset": offset,
-            "total_count": total_count
         }
+
+    # Any new animation or changed author makes the cached pages stale
+    return await response_cache.respond(request, ["animations", "authors"], build, dict)
+
+@router.get("/search", response_model=dict)
+async def search_animations(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100, description="Words searched in animation names and descriptions"),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT, description="Number of results to retrieve"),
+    offset: int = Query(0, ge=0, description="Offset for pagination")
+):
+    # Public animations ranked by relevance, the items are the same as in the feed
+    async def build():
+        animations = await AnimationRepository.search_animations(q, limit=limit, offset=offset, fields=EXPLORE_FIELDS)
+        items = await feed_items(request, animations)
+        for item, animation in zip(items, animations):
+            item["score"] = round(animation["score"], 3)
+        return {"animations": items, "pagination": {"limit": limit, "offset": offset}}
+
+    return await response_cache.respond(request, ["animations", "authors"], build, dict)
+
+@router.get("/autocomplete", response_model=dict)
+async def autocomplete(
+    prefix: str = Query(..., min_length=1, max_length=100, description="Beginning of a user or animation name"),
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT, description="Number of names of each kind")
+):
+    # Served from in-process name indexes, case and accents are ignored
+    return {
+        "users": await user_name_index.search(prefix, limit),
+        "animations": await animation_name_index.search(prefix, limit),
     }
-    return response
\ No newline at end of file
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
+from ..core.config import MAX_UPLOAD_BYTES
+from ..repositories.garment_repository import GarmentRepository
+from ..repositories.user_repository import UserRepository
+from ..schemas.garment_schema import GarmentCodeDecode, GarmentResolution
+from ..services.glyph_decode_service import GlyphDecodeService
+from ..services.glyph_recognition import RecognitionError
+from .users import avatar_url
+
+router = APIRouter()
+
+@router.get("/by-uid/{uid}", response_model=GarmentResolution)
+async def resolve_garment_uid(uid: str, request: Request):
+    # Hot path of AR scanning, repeated and unknown uids are answered from memory
+    resolved = await GarmentRepository.get_by_uid(uid)
+    if not resolved:
+        raise HTTPException(status_code=404, detail="Garment not found")
+
+    owner_id = resolved["user_id"]
+    garment = resolved["garment"]
+    owner = (await UserRepository.get_authors_by_ids([owner_id])).get(owner_id, {})
+
+    links = [
+        {"rel": "owner", "href": str(request.url_for("get_user", user_id=owner_id))},
+        {"rel": "garments", "href": str(request.url_for("get_user_garments", user_id=owner_id))}
+    ]
+    if garment.get("animationId"):
+        links.append({"rel": "animation", "href": str(request.url_for("get_animation", animation_id=garment["animationId"]))})
+
+    return {
+        "uid": uid,
+        "garment": garment,
+        "owner_id": owner_id,
+        "owner_name": owner.get("name"),
+        "owner_avatar_url": avatar_url(request, {"id": owner_id, **owner}),
+        "animation_id": garment.get("animationId"),
+        "links": links
+    }
+
+
+@router.post("/decode", response_model=GarmentCodeDecode)
+async def decode_garment_code(request: Request, photo: UploadFile = File(...)):
+    # Reads the printed glyph code from a photo, for clients without on-device recognition
+    if photo.size is not None and photo.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    # The size is not always known up front, one byte more than allowed tells it is too large
+    data = await photo.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    try:
+        result = await GlyphDecodeService.decode(data)
+    except RecognitionError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    uid = str(result["uid"])
+    return {
+        "uid": uid,
+        "code": result["code"],
+        "confidence": result["confidence"],
+        "scores": result["scores"],
+        "links": [{"rel": "garment", "href": str(request.url_for("resolve_garment_uid", uid=uid))}]
+    }
@@ -1,83 +1,244 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, Request
-from ..models.user import UserCreate, UserResponse, UserUpdate
+from pathlib import Path
+from typing import List, Optional
+from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import RedirectResponse
+from gridfs.errors import NoFile
+from pymongo.errors import DuplicateKeyError
+from ..models.user import UserCreate, UserRequest, UserResponse, UserSummary, UserUpdate
 from ..models.garments_model import Garment, GarmentCreate
-from ..repositories.user_repository import UserRepository
+from ..models.bulk import BulkCreateResponse
+from ..repositories.user_repository import UserRepository, USER_LIST_FIELDS, USER_SUMMARY_FIELDS
+from ..repositories.file_repository import FileRepository, UploadTooLarge
+from ..services.thumbnail_service import ThumbnailService, THUMBNAIL_SIZES
+from ..utils.file_responses import gridfs_file_response, static_file_response
 from ..utils.security import create_access_token
+from ..core.response_cache import response_cache
+from ..utils.fast_responses import FastJSONResponse, link_template, model_defaults, ndjson_response, wants_ndjson
 
 router = APIRouter()
 
+DEFAULT_AVATAR_PATH = Path(__file__).resolve().parents[2] / "props" / "default_profile_picture_base64.txt"
+
+
+def avatar_url(request: Request, user: dict) -> str:
+    # Versioned by the avatar file id, so clients and proxies can cache it for good
+    url = link_template(request, "get_user_avatar", "user_id").format(user_id=user["id"])
+    if user.get("avatarFileId"):
+        url += f"?v={user['avatarFileId']}"
+    return url
+
+
+def user_list_item(request: Request):
+    # Returns the converter of a repository user to its list item, links are resolved once
+    defaults = model_defaults(UserResponse)
+    self_link = link_template(request, "get_user", "user_id")
+    garments_link = link_template(request, "get_user_garments", "user_id")
+
+    def to_item(user: dict) -> dict:
+        user['avatarUrl'] = avatar_url(request, user)
+        user.pop('avatarFileId', None)
+        user['links'] = [
+            {"rel": "self", "href": self_link.format(user_id=user['id'])},
+            {"rel": "garments", "href": garments_link.format(user_id=user['id'])}
+        ]
+        return {**defaults, **user}
+    return to_item
+
+
 @router.get("/", response_model=List[UserResponse])
-async def get_all_users(request: Request):
-    users = UserRepository.get_all_users()
+async def get_all_users(
+    request: Request,
+    stream: bool = Query(False, description="Stream all users as NDJSON, same as Accept: application/x-ndjson")
+):
+    # Only the documented fields are loaded, so the list is sent without validating it again
+    to_item = user_list_item(request)
+    if wants_ndjson(request, stream):
+        return ndjson_response(UserRepository.iter_all_users(fields=USER_LIST_FIELDS), to_item)
+    users = await UserRepository.get_all_users(fields=USER_LIST_FIELDS)
+    return FastJSONResponse([to_item(user) for user in users])
+
+# Declared before /{user_id} so they are not taken for a user id
+@router.get("/summary", response_model=List[UserSummary])
+async def get_users_summary(request: Request):
+    users = await UserRepository.get_all_users(fields=USER_SUMMARY_FIELDS)
+    self_link = link_template(request, "get_user", "user_id")
     for user in users:
+        user['avatarUrl'] = avatar_url(request, user)
+        user.pop('avatarFileId', None)
         user['links'] = [
-            {"rel": "self", "href": str(request.url_for("get_user", user_id=user['id']))},
-            {"rel": "garments", "href": str(request.url_for("get_user_garments", user_id=user['id']))}
+            {"rel": "self", "href": self_link.format(user_id=user['id'])}
         ]
-    return users
+    return FastJSONResponse(users)
+
+@router.get("/default-avatar")
+async def get_default_avatar(request: Request):
+    return static_file_response(request, DEFAULT_AVATAR_PATH, media_type="image/png", base64_encoded=True)
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(user_id: str, request: Request):
-    user = UserRepository.get_user_by_id(user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user['links'] = [
-        {"rel": "self", "href": str(request.url)},
-        {"rel": "garments", "href": str(request.url_for("get_user_garments", user_id=user_id))}
-    ]
-    return user
+    async def build():
+        user = await UserRepository.get_user_by_id(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        user['avatarUrl'] = avatar_url(request, user)
+        user['links'] = [
+            {"rel": "self", "href": str(request.url)},
+            {"rel": "garments", "href": str(request.url_for("get_user_garments", user_id=user_id))}
+        ]
+        return user
+
+    return await response_cache.respond(request, ["user", f"user:{user_id}"], build, UserResponse)
 
 @router.post("/", response_model=UserCreate)
-async def create_user(user: UserResponse, request: Request):
-    existing_user = UserRepository.get_user_by_name(user.name)
+async def create_user(user: UserRequest, request: Request):
+    existing_user = await UserRepository.get_user_by_name(user.name)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    created_user = UserRepository.create_user(user.model_dump(by_alias=True))
+    try:
+        created_user = await UserRepository.create_user(user.model_dump(by_alias=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     token = create_access_token(created_user['id'])
     created_user['token'] = token
+    created_user['avatarUrl'] = avatar_url(request, created_user)
     created_user['links'] = [
         {"rel": "self", "href": str(request.url_for("get_user", user_id=created_user['id']))},
         {"rel": "garments", "href": str(request.url_for("get_user_garments", user_id=created_user['id']))}
     ]
     return created_user
 
+# Most items one bulk create may contain
+BULK_CREATE_MAX_ITEMS = 1000
+
+@router.post("/batch", response_model=BulkCreateResponse)
+async def create_users(users: List[UserRequest]):
+    # Creates many users at once, every item gets its id and token or an error
+    if len(users) > BULK_CREATE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_CREATE_MAX_ITEMS} users per request")
+    try:
+        created = await UserRepository.create_users([user.model_dump(by_alias=True) for user in users])
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    results = [
+        {"index": index, "error": result} if isinstance(result, str)
+        else {"index": index, "id": result["id"], "token": create_access_token(result["id"])}
+        for index, result in enumerate(created)
+    ]
+    return {"created": sum(1 for result in results if not result.get("error")), "results": results}
+
 @router.put("/{user_id}", response_model=bool)
 async def update_user(user_id: str, user_update: UserUpdate):
-    updated = UserRepository.update_user(user_id, user_update.model_dump(exclude_unset=True))
+    try:
+        updated = await UserRepository.update_user(user_id, user_update.model_dump(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Garment uid is already linked")
     if not updated:
         raise HTTPException(status_code=404, detail="User not found")
     return updated
 
 @router.delete("/{user_id}", response_model=bool)
 async def delete_user(user_id: str):
-    deleted = UserRepository.delete_user(user_id)
+    deleted = await UserRepository.delete_user(user_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="User not found")
     return deleted
 
 @router.delete("/", response_model=bool)
 async def delete_all_users():
-    return UserRepository.delete_all_users()
+    return await UserRepository.delete_all_users()
+
+# Avatar Endpoints
+@router.get("/{user_id}/avatar")
+async def get_user_avatar(
+    user_id: str,
+    request: Request,
+    size: Optional[str] = Query(None, description=f"Resized variant, one of {', '.join(THUMBNAIL_SIZES)}. The original when omitted"),
+    v: Optional[str] = Query(None, description="Avatar version from avatarUrl, makes the response cacheable for good")
+):
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown avatar size, expected one of {', '.join(THUMBNAIL_SIZES)}")
+
+    exists, file_id = await UserRepository.get_avatar_file_id(user_id)
+    if not exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not file_id:
+        return RedirectResponse(request.url_for("get_default_avatar"))
+
+    try:
+        grid_out = await FileRepository.get_file(file_id)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="File not found in storage")
+
+    headers = {"Cache-Control": "public, max-age=31536000, immutable" if v == str(file_id) else "no-cache"}
+    if size:
+        derivative_id = await ThumbnailService.get_derivative_id(grid_out, size, request.headers.get("accept"))
+        if derivative_id:
+            grid_out = await FileRepository.get_file(derivative_id)
+        headers["Vary"] = "Accept"
+
+    return gridfs_file_response(
+        request,
+        grid_out,
+        media_type=FileRepository.get_content_type(grid_out) or "application/octet-stream",
+        headers=headers,
+    )
+
+@router.put("/{user_id}/avatar", response_model=bool)
+async def set_user_avatar(user_id: str, avatar: UploadFile = File(...)):
+    try:
+        avatar_id = await FileRepository.save_file_to_gridfs(avatar)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if not await UserRepository.set_avatar(user_id, avatar_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return True
 
 # Garments Endpoints
 @router.get("/{user_id}/garments", response_model=List[Garment])
-async def get_user_garments(user_id: str):
-    user = UserRepository.get_user_by_id(user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user["garments"]
+async def get_user_garments(user_id: str, request: Request):
+    async def build():
+        user = await UserRepository.get_user_by_id(user_id, fields=("garments",))
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user.get("garments", [])
+
+    return await response_cache.respond(request, ["user", f"user:{user_id}"], build, List[Garment])
 
 @router.post("/{user_id}/garments", response_model=Garment)
 async def add_garment_to_user(user_id: str, garment: GarmentCreate, request: Request):
-    updated_user = UserRepository.add_garment_to_user(user_id, garment)
-    if not updated_user:
+    try:
+        added = await UserRepository.add_garment_to_user(user_id, garment)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Garment uid is already linked")
+    if not added:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    garment_data = garment.model_dump()
+
+    # The stored garment, with the id /garments/by-uid resolves to
+    garment_data = added.model_dump()
     garment_data['links'] = [
         {"rel": "self", "href": str(request.url_for("get_user_garments", user_id=user_id))}
     ]
-    return garment_data
\ No newline at end of file
+    return garment_data
+
+@router.post("/{user_id}/garments/batch", response_model=BulkCreateResponse)
+async def add_garments_to_user(user_id: str, garments: List[GarmentCreate]):
+    if len(garments) > BULK_CREATE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_CREATE_MAX_ITEMS} garments per request")
+    added = await UserRepository.add_garments_to_user(user_id, garments)
+    if added is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    results = [
+        {"index": index, "error": result} if isinstance(result, str) else {"index": index, "id": result.id}
+        for index, result in enumerate(added)
+    ]
+    return {"created": sum(1 for result in results if not result.get("error")), "results": results}
@@ -0,0 +1,88 @@
+import asyncio
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class LRUCache:
+    """
+    Small bounded in-process cache with least-recently-used eviction.
+    Entries can optionally expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class RefreshingValue:
+    """
+    Keeps the result of an async `loader` for `ttl` seconds.
+    Once stale, the old value is still returned while a background task
+    refreshes it, so callers only wait for the very first load.
+    """
+
+    def __init__(self, loader, ttl: float = 30):
+        self.loader = loader
+        self.ttl = ttl
+        self._value = _MISSING
+        self._loaded_at = 0.0
+        self._refresh_task = None
+
+    async def get(self):
+        if self._value is _MISSING:
+            await self._refresh()
+        elif time.monotonic() - self._loaded_at > self.ttl and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return self._value
+
+    def invalidate(self):
+        # Mark the value as stale, the next get() schedules a refresh
+        self._loaded_at = 0.0
+
+    async def _refresh(self):
+        try:
+            self._value = await self.loader()
+            self._loaded_at = time.monotonic()
+        finally:
+            self._refresh_task = None
@@ -0,0 +1,85 @@
+import asyncio
+
+from .logger import logger
+
+
+class CounterBuffer:
+    """
+    Write-behind counters: increments are added up in process memory and
+    written every `interval` seconds, or as soon as `max_keys` documents have
+    pending counts, with one call of `flush(counts)`. `counts` maps a key to
+    the amounts of its fields, e.g. {animation_id: {"downloads": 3, "views": 12}},
+    so a flush is one write per key no matter how many increments it holds.
+
+    `flush` returns the counts it could not write (or None), they are put back
+    and written with the next flush. It must only raise when nothing was
+    written, otherwise the written counts would be added twice. stop() writes
+    what is left, counts are only lost if the process dies without it.
+    """
+
+    def __init__(self, flush, interval: float = 5, max_keys: int = 5000):
+        self._flush = flush
+        self.interval = interval
+        self.max_keys = max_keys
+        self._counts = {}
+        self._task = None
+        # Flushes in progress, awaited by stop()
+        self._flushes = set()
+
+    def add(self, key: str, field: str, amount: int = 1):
+        fields = self._counts.get(key)
+        if fields is None:
+            fields = self._counts[key] = {}
+            if len(self._counts) >= self.max_keys:
+                self._start_flush()
+        fields[field] = fields.get(field, 0) + amount
+
+    def clear(self):
+        self._counts = {}
+
+    async def flush(self):
+        counts, self._counts = self._counts, {}
+        if not counts:
+            return
+        try:
+            unwritten = await self._flush(counts)
+        except Exception as e:
+            logger.warning(f"Flushing counters of {len(counts)} documents failed: {e}")
+            unwritten = counts
+        if unwritten:
+            self._put_back(unwritten)
+
+    def _put_back(self, counts: dict):
+        # Increments are commutative, they are merged into what was counted meanwhile
+        for key, fields in counts.items():
+            pending = self._counts.setdefault(key, {})
+            for field, amount in fields.items():
+                pending[field] = pending.get(field, 0) + amount
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Called on shutdown, before the database client is closed
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+        if self._counts:
+            logger.error(f"Counters of {len(self._counts)} documents were not written before shutdown")
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+        return task
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # Shielded, so stopping the loop never cancels a write half way
+            await asyncio.shield(self._start_flush())
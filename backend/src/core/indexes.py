@@ -0,0 +1,35 @@
+from pymongo.errors import OperationFailure
+from .database import async_db as db
+from .logger import logger
+
+
+async def ensure_indexes():
+    # create_index is a no-op for indexes that already exist
+    # content hash of stored files, used to share identical uploads
+    await db["fs.files"].create_index("metadata.sha256", sparse=True)
+    # resized variants of a stored file
+    await db["fs.files"].create_index([("metadata.derivativeOf", 1), ("metadata.variant", 1)], sparse=True)
+    # one conversion job per source content, and the queue order of the worker
+    await db.conversion_jobs.create_index("key", unique=True)
+    await db.conversion_jobs.create_index([("status", 1), ("created_at", 1)])
+    # search over public animations, a name match counts more than one in the description
+    await db.animations.create_index(
+        [("isPublic", 1), ("animationName", "text"), ("animationDescription", "text")],
+        weights={"animationName": 10, "animationDescription": 2},
+        name="animations_text"
+    )
+    # explore feed pages, best ranked first, and the entries of an author
+    await db.explore_feed.create_index([("rank", -1), ("_id", -1)])
+    await db.explore_feed.create_index("author_id")
+    # user lookups by name on sign up
+    await db.users.create_index("name")
+    # resolving scanned garment uids, a uid belongs to one garment only
+    try:
+        await db.users.create_index(
+            "garments.uid",
+            unique=True,
+            partialFilterExpression={"garments.uid": {"$exists": True}}
+        )
+    except OperationFailure as e:
+        # existing duplicates have to be cleaned up first, lookups still work without it
+        logger.warning(f"Could not create the unique garments.uid index: {e}")
@@ -1,4 +1,116 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from threading import Lock
+
+from .config import (
+    LOG_FILE, LOG_FILE_BACKUPS, LOG_FILE_LEVEL, LOG_FILE_MAX_BYTES, LOG_FORMAT, LOG_LEVEL,
+    LOG_QUEUE_SIZE, LOG_RATE_BURST, LOG_RATE_LIMIT, LOG_SAMPLE_RATE,
+)
+
+# Id of the request being handled, added to every record logged while handling it
+request_id = ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has, anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "suppressed"}
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, fields passed with extra={...} are included
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        if record.suppressed:
+            entry["suppressed"] = record.suppressed
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Runs on the calling thread before the record is queued: adds the request id
+    and drops records over the rate limit of their logger and level, or not
+    picked by sampling (DEBUG/INFO only). The first record let through after
+    drops carries their number as `suppressed`.
+    """
+
+    def __init__(self, rate: float, burst: int, sample_rate: float):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample_rate = sample_rate
+        # (logger, level) -> [tokens, last refill, suppressed records]
+        self._buckets = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((record.name, record.levelno))
+            if bucket is None:
+                bucket = self._buckets[(record.name, record.levelno)] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+
+        record.request_id = request_id.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks the caller, records that do not fit in the queue are counted and dropped
+    dropped = 0
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare the record is not formatted here, only made
+        # picklable, so the handlers' formatters still see its fields
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _formatter(with_time: bool) -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    if with_time:
+        return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s')
+    return logging.Formatter('%(name)s - %(levelname)s - %(request_id)s - %(message)s')
+
 
 # Create a custom logger
 logger = logging.getLogger(__name__)
@@ -6,21 +118,77 @@ logger = logging.getLogger(__name__)
 # Set the default logging level
 logger.setLevel(logging.DEBUG)
 
-# Create handlers
+# Handlers that do the writing, they run on the listener's thread
 console_handler = logging.StreamHandler()
-file_handler = logging.FileHandler('app.log')
+console_handler.setLevel(LOG_LEVEL)
+console_handler.setFormatter(_formatter(with_time=False))
+handlers = [console_handler]
+
+# Processes must not rotate the same file, "{pid}" in LOG_FILE gives each one its own
+if LOG_FILE:
+    file_handler = RotatingFileHandler(
+        LOG_FILE.format(pid=os.getpid()), maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS
+    )
+    file_handler.setLevel(LOG_FILE_LEVEL)
+    file_handler.setFormatter(_formatter(with_time=True))
+    handlers.append(file_handler)
+
+# The request path only puts records on a queue, console and file I/O happen on a background thread
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+queue_handler.addFilter(ContextFilter(LOG_RATE_LIMIT, LOG_RATE_BURST, LOG_SAMPLE_RATE))
+logger.addHandler(queue_handler)
+
+listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+listener.start()
+
+
+def stop_logging():
+    # Writes out the queued records and stops the writer thread
+    if listener._thread is not None:
+        listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware giving every request an id (X-Request-ID of the request or a
+    new one, returned in the response) and logging its method, path, status and
+    duration when it finishes.
+    """
+
+    def __init__(self, app):
+        self.app = app
 
-# Set logging level for handlers
-console_handler.setLevel(logging.DEBUG)
-file_handler.setLevel(logging.WARNING)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-# Create formatters and add them to handlers
-console_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
-file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        headers = dict(scope["headers"])
+        current_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        token = request_id.set(current_id)
+        status = [500]
 
-console_handler.setFormatter(console_format)
-file_handler.setFormatter(file_format)
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", current_id.encode("latin-1"))]
+            await send(message)
 
-# Add handlers to the logger
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
\ No newline at end of file
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            logger.info(
+                "request finished",
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status[0],
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                },
+            )
+            request_id.reset(token)
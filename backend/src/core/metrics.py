@@ -0,0 +1,329 @@
+"""
+Minimal Prometheus instrumentation: counters, gauges and histograms kept in
+process memory and rendered in the text exposition format by /metrics.
+
+Updates are a dict lookup and an add under a lock, cheap enough to stay on in
+production. Mongo commands and connection pool events are recorded by pymongo
+listeners, HTTP requests by MetricsMiddleware.
+
+Every worker process has its own values. With several workers each one writes
+them to METRICS_DIR (write_snapshots) and /metrics exports the values of all
+of them with a "pid" label, whichever worker answers the scrape.
+"""
+from bisect import bisect_left
+from threading import Lock
+import asyncio
+import json
+import os
+import time
+
+from pymongo import monitoring
+
+from .logger import logger
+
+# Seconds, from a fast cached read to a slow upload
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+        if not self.labels and self.kind != "histogram":
+            # Exported as 0 before the first update
+            self._values[()] = 0
+        REGISTRY.append(self)
+
+    def items(self):
+        # [label values, value] pairs, as written to the snapshot of this process
+        with self._lock:
+            return [[list(label_values), value] for label_values, value in self._values.items()]
+
+    def render(self, workers=None):
+        # `workers` are {pid: items()} of every process, their series get a pid label
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if workers is None:
+            for label_values, value in self.items():
+                yield from self._render_value(self.labels, tuple(label_values), value)
+            return
+        for pid, items in workers.items():
+            for label_values, value in items:
+                yield from self._render_value(self.labels + ("pid",), (*label_values, pid), value)
+
+    def _render_value(self, labels, label_values, value):
+        yield f"{self.name}{_format_labels(labels, label_values)} {value}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        # Only the bucket the value falls in is counted, render() accumulates them
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def items(self):
+        # Copies, the lists of an entry keep changing
+        with self._lock:
+            return [[list(label_values), [list(counts), total, count]]
+                    for label_values, (counts, total, count) in self._values.items()]
+
+    def _render_value(self, labels, label_values, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            bucket_labels = _format_labels(labels + ("le",), label_values + (bound,))
+            yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+        labels = _format_labels(labels, label_values)
+        yield f"{self.name}_sum{labels} {total}"
+        yield f"{self.name}_count{labels} {count}"
+
+
+REGISTRY = []
+
+
+def render_metrics(directory: str = "") -> str:
+    """
+    Renders the metrics of this process, or of every worker that wrote a
+    snapshot to `directory`. Reads files, so call it outside the event loop.
+    """
+    if not directory:
+        return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+    # The values of this process are exported as they are now
+    write_snapshot(directory)
+    workers = _read_snapshots(directory)
+    return "\n".join(
+        line for metric in REGISTRY
+        for line in metric.render({pid: snapshot.get(metric.name, []) for pid, snapshot in workers.items()})
+    ) + "\n"
+
+
+def _snapshot_path(directory: str) -> str:
+    return os.path.join(directory, f"{os.getpid()}.json")
+
+
+def write_snapshot(directory: str):
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory)
+    with open(path + ".tmp", "w") as file:
+        json.dump({metric.name: metric.items() for metric in REGISTRY}, file)
+    os.replace(path + ".tmp", path)
+
+
+def remove_snapshot(directory: str):
+    try:
+        os.remove(_snapshot_path(directory))
+    except FileNotFoundError:
+        pass
+
+
+def _read_snapshots(directory: str, max_age: float = 60):
+    # Snapshots not written for `max_age` seconds are of workers that died, they are removed
+    workers = {}
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                continue
+            with open(path) as file:
+                workers[name[:-len(".json")]] = json.load(file)
+        except (OSError, ValueError):
+            # removed or replaced meanwhile
+            continue
+    return workers
+
+
+async def write_snapshots(directory: str, interval: float):
+    # Runs in every worker while the app is up, so the other workers can export its values
+    try:
+        while True:
+            try:
+                await asyncio.to_thread(write_snapshot, directory)
+            except OSError as e:
+                logger.warning(f"Writing the metrics snapshot failed: {e}")
+            await asyncio.sleep(interval)
+    finally:
+        remove_snapshot(directory)
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests by route template", ("method", "route", "status")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests being handled")
+
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Latency of MongoDB commands", ("command", "collection")
+)
+mongo_command_failures = Counter(
+    "mongo_command_failures_total", "MongoDB commands that failed", ("command", "collection")
+)
+
+mongo_pool_connections = Gauge("mongo_pool_connections", "Open connections of the MongoDB pool", ("address",))
+mongo_pool_checked_out = Gauge("mongo_pool_checked_out", "MongoDB connections in use", ("address",))
+mongo_pool_checkout_failures = Counter(
+    "mongo_pool_checkout_failures_total", "Failed checkouts of a MongoDB connection", ("address", "reason")
+)
+
+gridfs_bytes_read = Counter("gridfs_bytes_read_total", "Bytes read from GridFS")
+gridfs_bytes_written = Counter("gridfs_bytes_written_total", "Bytes written to GridFS")
+
+response_cache_hits = Counter("response_cache_hits_total", "Responses served from the response cache")
+response_cache_misses = Counter("response_cache_misses_total", "Responses built because they were not cached")
+
+
+class CommandMetrics(monitoring.CommandListener):
+    # Times every command by name and collection. Only the started event carries
+    # the command document, the collection is remembered until the reply arrives
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+        mongo_command_failures.inc(event.command_name, collection)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    # Connection counts of every server's pool
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = _address(event)
+        mongo_pool_connections.set(address, value=0)
+        mongo_pool_checked_out.set(address, value=0)
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc(_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec(_address(event))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_pool_checkout_failures.inc(_address(event), event.reason)
+
+    def connection_checked_out(self, event):
+        mongo_pool_checked_out.inc(_address(event))
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.dec(_address(event))
+
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. The route label is the path
+    template (e.g. /users/{user_id}), so ids do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], _route_template(scope), status[0])
+
+
+def _route_template(scope) -> str:
+    # Newer FastAPI keeps the route of an included router relative to its prefix,
+    # the full template is on the effective route context
+    context = (scope.get("fastapi") or {}).get("effective_route_context")
+    route = context or scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
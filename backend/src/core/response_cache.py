@@ -0,0 +1,195 @@
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+import time
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from .config import RESPONSE_CACHE_MAX_AGE, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_URL
+from .logger import logger
+from .metrics import response_cache_hits, response_cache_misses
+
+try:
+    from redis.exceptions import RedisError
+    # Errors of an unreachable cache backend, the cache is skipped instead of failing the request
+    BACKEND_ERRORS = (RedisError, OSError)
+except ImportError:
+    BACKEND_ERRORS = (OSError,)
+
+
+class MemoryBackend:
+    """
+    In-process store evicting the least recently used entries once
+    the cached bodies take more than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = Lock()
+
+    async def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    async def get_counters(self, keys):
+        return [self._counters.get(key, 0) for key in keys]
+
+    async def incr(self, key: str):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+class RedisBackend:
+    # Shared between all workers and instances, needs the optional `redis` package
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self.evictions = 0
+
+    async def get(self, key: str):
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._redis.set(key, value, px=int(ttl * 1000))
+
+    async def get_counters(self, keys):
+        return [int(value or 0) for value in await self._redis.mget(keys)]
+
+    async def incr(self, key: str):
+        await self._redis.incr(key)
+
+
+def create_backend():
+    if RESPONSE_CACHE_URL:
+        try:
+            return RedisBackend(RESPONSE_CACHE_URL)
+        except ImportError:
+            logger.warning("RESPONSE_CACHE_URL is set but redis is not installed, using the in-process cache")
+    return MemoryBackend(RESPONSE_CACHE_MAX_BYTES)
+
+
+@lru_cache(maxsize=None)
+def _adapter(response_model):
+    return TypeAdapter(response_model)
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized JSON responses.
+
+    Every entry is tagged (e.g. "user:<id>") and stores the version of each of
+    its tags when it was built. Invalidating a tag bumps its version, so older
+    entries are ignored without having to find them, in any backend.
+    """
+
+    def __init__(self, backend, ttl: float = RESPONSE_CACHE_TTL, max_age: int = RESPONSE_CACHE_MAX_AGE):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    async def respond(self, request: Request, tags, build, response_model) -> Response:
+        """
+        Returns the cached response for this URL, or awaits `build()`, validates
+        and serializes its result with `response_model` and caches it.
+        Exceptions raised by `build` (e.g. a 404) are not cached. When the
+        backend is unreachable the response is built as if it was not cached.
+        """
+        key = self._key(request)
+        try:
+            versions = await self.backend.get_counters([f"tag:{tag}" for tag in tags])
+            cached = await self.backend.get(key)
+        except BACKEND_ERRORS as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            versions, cached = None, None
+        if cached is not None:
+            header, body = cached.split(b"\n", 1)
+            if json.loads(header) == versions:
+                self.hits += 1
+                response_cache_hits.inc()
+                return self._response(body, "HIT")
+
+        self.misses += 1
+        response_cache_misses.inc()
+        adapter = _adapter(response_model)
+        body = adapter.dump_json(adapter.validate_python(await build()))
+        if versions is not None:
+            try:
+                await self.backend.set(key, json.dumps(versions).encode() + b"\n" + body, self.ttl)
+            except BACKEND_ERRORS as e:
+                logger.warning(f"Storing a cached response failed: {e}")
+        return self._response(body, "MISS")
+
+    async def invalidate(self, *tags):
+        # A failed invalidation is logged and does not fail the write that caused it,
+        # the stale entries expire with the TTL
+        for tag in tags:
+            try:
+                await self.backend.incr(f"tag:{tag}")
+            except BACKEND_ERRORS as e:
+                logger.warning(f"Invalidating the cached responses of {tag} failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        # Counts of this worker process, /metrics has those of all workers
+        stats = {
+            "backend": type(self.backend).__name__,
+            "pid": os.getpid(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.backend.evictions,
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats["entries"] = len(self.backend._entries)
+            stats["bytes"] = self.backend.size
+        return stats
+
+    @staticmethod
+    def _key(request: Request) -> str:
+        # Links in the body are absolute, so the host is part of the key
+        query = "&".join(sorted(f"{name}={value}" for name, value in request.query_params.multi_items()))
+        return f"response:{request.base_url}{request.url.path}?{query}"
+
+    def _response(self, body: bytes, status: str) -> Response:
+        return Response(
+            body,
+            media_type="application/json",
+            headers={"Cache-Control": f"public, max-age={self.max_age}", "X-Cache": status},
+        )
+
+
+# Shared by all routes of this process
+response_cache = ResponseCache(create_backend())
@@ -0,0 +1,110 @@
+import asyncio
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from .logger import logger
+
+
+def normalize(text: str) -> str:
+    # Case and accent insensitive form used for matching, "Šál" -> "sal"
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+class PrefixIndex:
+    """
+    In-process sorted index of distinct names for autocomplete. A prefix
+    lookup is two binary searches over the sorted keys.
+
+    `loader(after_id)` returns (id, name) pairs of the documents with an _id
+    greater than `after_id`, or of all documents when it is None. Names stored
+    by this process are added right away with add(). Every `refresh` seconds
+    the documents inserted since the last load (e.g. by other workers) are
+    added, and every `rebuild` seconds the index is loaded again from scratch,
+    which also drops deleted and renamed entries.
+    """
+
+    def __init__(self, loader, refresh: float = 30, rebuild: float = 600):
+        self.loader = loader
+        self.refresh = refresh
+        self.rebuild = rebuild
+        self._keys = []
+        self._names = {}
+        self._last_id = None
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self._task = None
+        # Names added while a full load runs, kept when its result replaces the index
+        self._added_while_loading = None
+
+    def add(self, name: str):
+        key = normalize(name or "")
+        if not key:
+            return
+        if self._added_while_loading is not None:
+            self._added_while_loading.setdefault(key, name)
+        if key not in self._names:
+            insort(self._keys, key)
+            self._names[key] = name
+
+    def clear(self):
+        self._keys, self._names = [], {}
+
+    async def search(self, prefix: str, limit: int = 10):
+        await self._ensure_fresh()
+        key = normalize(prefix)
+        if not key:
+            return []
+        start = bisect_left(self._keys, key)
+        end = bisect_left(self._keys, key + "\uffff", start)
+        return [self._names[k] for k in self._keys[start:min(end, start + limit)]]
+
+    def warm_up(self):
+        # Starts the first load in the background
+        if not self._loaded and self._task is None:
+            self._task = asyncio.create_task(self._load(full=True))
+
+    async def _ensure_fresh(self):
+        if not self._loaded:
+            if self._task is None:
+                self._task = asyncio.create_task(self._load(full=True))
+            await asyncio.shield(self._task)
+            return
+        now = time.monotonic()
+        if self._task is None and now - self._refreshed_at > self.refresh:
+            self._task = asyncio.create_task(self._load(full=now - self._rebuilt_at > self.rebuild))
+
+    async def _load(self, full: bool):
+        if full:
+            self._added_while_loading = {}
+        try:
+            started = time.monotonic()
+            last_id = None if full else self._last_id
+            names = {}
+            async for document_id, name in self.loader(last_id):
+                if last_id is None or document_id > last_id:
+                    last_id = document_id
+                key = normalize(name or "")
+                if key:
+                    names.setdefault(key, name)
+
+            if full:
+                names.update(self._added_while_loading)
+                self._keys, self._names = sorted(names), names
+                self._rebuilt_at = started
+            else:
+                for key, name in names.items():
+                    if key not in self._names:
+                        insort(self._keys, key)
+                        self._names[key] = name
+            self._last_id = last_id
+            self._loaded = True
+            self._refreshed_at = started
+        except Exception as e:
+            # Searches use what is loaded, the next one tries again
+            logger.warning(f"Loading the name index failed: {e}")
+        finally:
+            self._task = None
+            self._added_while_loading = None
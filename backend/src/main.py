@@ -1,15 +1,66 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .api import users, animations, explore, library
+from fastapi.responses import JSONResponse, PlainTextResponse
+from .api import users, animations, explore, garments, library
+from .core import database
+from .core.config import METRICS_DIR, METRICS_WRITE_INTERVAL
+from .core.indexes import ensure_indexes
+from .core.logger import RequestLogMiddleware
+from .core.metrics import MetricsMiddleware, render_metrics, write_snapshots
+from .core.response_cache import response_cache
+from .repositories import animation_repository, user_repository
+from .repositories.feed_repository import FeedRepository
+from .services.thumbnail_service import ThumbnailService
 
-app = FastAPI()
 
-# Simple health check for client
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every worker process opens its own connection pool
+    database.connect()
+    await ensure_indexes()
+    await database.warm_up()
+    await FeedRepository.ensure_built()
+    # Name indexes of the autocomplete load in the background
+    animation_repository.name_index.warm_up()
+    user_repository.name_index.warm_up()
+    animation_repository.counters.start()
+    # With several workers every one shares its metrics through METRICS_DIR
+    metrics_task = asyncio.create_task(write_snapshots(METRICS_DIR, METRICS_WRITE_INTERVAL)) if METRICS_DIR else None
+    yield
+    if metrics_task:
+        metrics_task.cancel()
+        await asyncio.gather(metrics_task, return_exceptions=True)
+    # Buffered counts are written while the client is still open
+    await animation_repository.counters.stop()
+    database.close()
+    ThumbnailService.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestLogMiddleware)
+
+# Simple health check for client, ready once the database pool is warm
 @app.get("/health")
 async def health_check():
+    if not database.is_ready():
+        return JSONResponse({"status": "starting"}, status_code=503)
     return {"status": "ok"}
 
+# Prometheus scrape endpoint, a plain def so reading the snapshots of the workers runs in the threadpool
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(METRICS_DIR), media_type="text/plain; version=0.0.4")
+
+# Hit/miss counters of the response cache in the worker answering the request
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
 # Include routers
 app.include_router(users.router, prefix="/users", tags=["Users"])
 app.include_router(animations.router, prefix="/animations", tags=["Animations"])
 app.include_router(explore.router, prefix="/explore", tags=["Explore page"])
+app.include_router(garments.router, prefix="/garments", tags=["Garments"])
 app.include_router(library.router, prefix="/library", tags=["Library"])
@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class BulkItemResult(BaseModel):
+    # outcome of one item of a bulk request, `index` is its position in the request
+    index: int
+    id: Optional[str] = None
+    token: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BulkCreateResponse(BaseModel):
+    created: int
+    results: List[BulkItemResult] = []
@@ -1,12 +1,16 @@
 from pydantic import BaseModel
 from pydantic import BaseModel, Field
+from typing import Optional
 from bson import ObjectId
 
 class Garment(BaseModel):
     id: str = Field(default_factory=lambda: str(ObjectId()))
     name: str
     uid: str
+    # animation shown when the garment is scanned
+    animationId: Optional[str] = None
 
 class GarmentCreate(BaseModel):
     name: str
-    uid: str
\ No newline at end of file
+    uid: str
+    animationId: Optional[str] = None
\ No newline at end of file
@@ -15,7 +15,7 @@ class UserBase(BaseModel):
     joinedDate: Optional[str] = None
 
     # Optional fields
-    imageBase64: Optional[str] = None
+    avatarUrl: Optional[str] = None
     description: Optional[str] = None
     
     # Required fields
@@ -25,6 +25,11 @@ class UserBase(BaseModel):
     garments: Optional[List[Garment]] = []
 
 
+class UserRequest(UserBase):
+    # Accepted from older app builds, stored as the avatar and never returned
+    imageBase64: Optional[str] = None
+
+
 class UserCreate(UserBase):
     token: str  # Add token field to response
 
@@ -38,4 +43,12 @@ class UserUpdate(BaseModel):
 
 
 class UserResponse(UserBase):
-    links: List[Link] = []
\ No newline at end of file
+    links: List[Link] = []
+
+
+class UserSummary(BaseModel):
+    # list view of a user
+    id: str
+    name: str
+    avatarUrl: Optional[str] = None
+    links: List[Link] = []
@@ -1,70 +1,169 @@
-from ..core.database import db, grid_fs
+from ..core.database import async_db as db
+from ..core.config import (
+    COUNTER_FLUSH_INTERVAL, COUNTER_FLUSH_MAX_KEYS, SEARCH_INDEX_REBUILD, SEARCH_INDEX_REFRESH, STREAM_BATCH_SIZE,
+)
+from ..core.counters import CounterBuffer
+from ..core.logger import logger
+from ..core.response_cache import response_cache
+from ..core.search_index import PrefixIndex
 from ..models.animations_model import AnimationRequest
+from .feed_repository import FeedRepository
 from .user_repository import UserRepository
+from .file_repository import FileRepository
+from .projection import id_projection
 from bson import ObjectId
 from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
-class AnimationRepository:
+# Fields of the animation list view
+ANIMATION_SUMMARY_FIELDS = ("animationName", "author_id", "isPublic", "created_at")
 
-    @staticmethod
-    async def save_file_to_gridfs(upload_file):
-        # Save the file to GridFS asynchronously
-        file_id = grid_fs.put(
-            await upload_file.read(),
-            filename=upload_file.filename,
-            content_type=upload_file.content_type
-        )
-        return file_id
+# Fields of AnimationResponse, lists are serialized without validating them again
+ANIMATION_LIST_FIELDS = (
+    "animationName", "animationDescription", "isPublic", "physicalWidth", "physicalHeight",
+    "author_id", "animationFileId", "created_at", "downloads", "views"
+)
+
+class AnimationRepository:
 
     @staticmethod
-    def create_animation(animation_data: AnimationRequest):
+    async def create_animation(animation_data: AnimationRequest):
         animation_data['created_at'] = datetime.now().strftime("%d/%m/%Y")
 
-        result = db.animations.insert_one(animation_data)
+        result = await db.animations.insert_one(animation_data)
         animation_data["id"] = str(result.inserted_id)
+        animation_data.pop("_id", None)
+        if animation_data.get("isPublic"):
+            name_index.add(animation_data.get("animationName"))
+            author_id = animation_data.get("author_id")
+            authors = await UserRepository.get_authors_by_ids([author_id] if author_id else [])
+            await FeedRepository.add_animation(animation_data, authors.get(author_id))
+        await response_cache.invalidate("animations")
         return animation_data
 
     @staticmethod
-    def get_all_animations():
-        animations = list(db.animations.find())
-        for animation in animations:
-            animation['id'] = str(animation['_id'])
-            del animation['_id']
-        return animations
+    async def get_animation_by_id(animation_id: str, fields=None):
+        animations = await db.animations.aggregate([
+            {"$match": {"_id": ObjectId(animation_id)}},
+            {"$limit": 1},
+            *id_projection(fields)
+        ]).to_list(length=1)
+        return animations[0] if animations else None
 
     @staticmethod
-    def get_animation_by_id(animation_id: str):
-        animation = db.animations.find_one({"_id": ObjectId(animation_id)})
-        if animation:
-            animation['id'] = str(animation['_id'])
-            del animation['_id']
-        return animation
+    async def get_animations_by_ids(animation_ids, fields=None):
+        """
+        Fetches many animations with one $in query.
+        Returns a dict by id, ids that are not valid or do not exist are left out.
+        """
+        object_ids = [ObjectId(animation_id) for animation_id in set(animation_ids) if ObjectId.is_valid(animation_id)]
+        if not object_ids:
+            return {}
+        animations = await db.animations.aggregate([
+            {"$match": {"_id": {"$in": object_ids}}},
+            *id_projection(fields)
+        ]).to_list(length=None)
+        return {animation["id"]: animation for animation in animations}
 
     @staticmethod
-    async def get_animation_file(file_id: str):
-        # Retrieve the file from GridFS
-        grid_out = grid_fs.get(ObjectId(file_id))
-        return grid_out
+    async def delete_all_animations():
+        files = db.animations.find({}, {"animationFileId": 1, "thumbnailFileId": 1})
+        async for animation in files:
+            for file_id in (animation.get("animationFileId"), animation.get("thumbnailFileId")):
+                if file_id:
+                    await FileRepository.release_file(file_id)
+        result = await db.animations.delete_many({})
+        name_index.clear()
+        counters.clear()
+        await FeedRepository.clear()
+        await response_cache.invalidate("animation", "animations")
+        return bool(result.deleted_count)
+    
+    @staticmethod
+    async def get_all_animations(limit: int = 10, offset: int = 0, fields=None):
+        # `fields` limits the returned fields, the id is always included
+        pipeline = [{"$skip": offset}]
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline += id_projection(fields)
+        return await db.animations.aggregate(pipeline).to_list(length=None)
 
     @staticmethod
-    async def get_animation_file(file_id: str):
-        # Retrieve the file from GridFS
-        grid_out = grid_fs.get(ObjectId(file_id))
-        return grid_out
-    
+    def iter_all_animations(fields=None):
+        # Cursor over all animations for streaming, fetched STREAM_BATCH_SIZE documents at a time
+        return db.animations.aggregate(id_projection(fields), batchSize=STREAM_BATCH_SIZE)
+
     @staticmethod
-    def delete_all_animations():
-        result = db.animations.delete_many({})
-        return bool(result.deleted_count)
-    
+    def record_download(animation_id: str):
+        # Buffered, written by the next flush of the counters
+        counters.add(animation_id, "downloads")
+
+    @staticmethod
+    def record_view(animation_id: str):
+        counters.add(animation_id, "views")
+
+    @staticmethod
+    async def add_counts(counts: dict):
+        """
+        Writes buffered {animation_id: {"downloads": n, "views": n}} with one
+        bulk_write, downloads are added to the feed entries as well, which move
+        up with them. Returns the counts of the animations whose update failed,
+        so the counter buffer writes them again. A failed feed update is only
+        logged, the counts are on the animations already.
+        """
+        animation_ids = list(counts)
+        try:
+            await db.animations.bulk_write(
+                [UpdateOne({"_id": ObjectId(animation_id)}, {"$inc": counts[animation_id]}) for animation_id in animation_ids],
+                ordered=False
+            )
+            unwritten = {}
+        except BulkWriteError as e:
+            # The other updates of the unordered write were applied
+            failed = {animation_ids[error["index"]] for error in e.details.get("writeErrors", [])}
+            unwritten = {animation_id: counts[animation_id] for animation_id in failed}
+            logger.warning(f"Counters of {len(failed)} animations were not written: {e}")
+
+        written = {animation_id: fields for animation_id, fields in counts.items() if animation_id not in unwritten}
+        downloads = {animation_id: fields["downloads"] for animation_id, fields in written.items() if fields.get("downloads")}
+        try:
+            await FeedRepository.add_downloads(downloads)
+        except Exception as e:
+            logger.warning(f"Adding downloads of {len(written)} animations to the feed failed: {e}")
+        if downloads:
+            # Downloads change the feed order, cached feed pages are built again. Cached
+            # animations are left alone, the most viewed ones would be rebuilt every flush
+            await response_cache.invalidate("animations")
+        return unwritten
+
     @staticmethod
-    def get_all_animations(limit: int = 10, offset: int = 0):
-        animations = list(db.animations.find().skip(offset).limit(limit))
-        for animation in animations:
-            animation['id'] = str(animation['_id'])
-            del animation['_id']
-        return animations
+    async def search_animations(text: str, limit: int = 20, offset: int = 0, fields=None):
+        """
+        Public animations matching `text` in their name or description, best
+        matches first. Uses the text index, the relevance is returned as `score`.
+        """
+        return await db.animations.aggregate([
+            {"$match": {"isPublic": True, "$text": {"$search": text}}},
+            {"$sort": {"score": {"$meta": "textScore"}, "_id": -1}},
+            {"$skip": offset},
+            {"$limit": limit},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+            *id_projection((*fields, "score") if fields else None)
+        ]).to_list(length=None)
 
     @staticmethod
-    def get_total_count():
-        return db.animations.count_documents({})
\ No newline at end of file
+    async def iter_public_names(after_id=None):
+        # (id, name) of public animations, inserted after `after_id` when given
+        query = {"isPublic": True}
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        async for animation in db.animations.find(query, {"animationName": 1}, batch_size=STREAM_BATCH_SIZE):
+            yield animation["_id"], animation.get("animationName")
+
+
+# Names of public animations for autocomplete
+name_index = PrefixIndex(AnimationRepository.iter_public_names, SEARCH_INDEX_REFRESH, SEARCH_INDEX_REBUILD)
+
+# Download and view counts, one write per animation per flush instead of one per request
+counters = CounterBuffer(AnimationRepository.add_counts, COUNTER_FLUSH_INTERVAL, COUNTER_FLUSH_MAX_KEYS)
@@ -0,0 +1,158 @@
+from ..core.database import async_db as db
+from ..core.cache import RefreshingValue
+from ..core.config import FEED_RANK_SECONDS
+from bson import ObjectId
+from pymongo import UpdateOne
+import math
+
+# Fields of a feed entry, copied from the animation and its author when it is added
+FEED_FIELDS = (
+    "animationName", "author_id", "author_name", "author_avatar_file_id", "thumbnailFileId", "thumbnail",
+    "created_at", "physicalWidth", "physicalHeight", "downloads",
+)
+
+# Number of public animations, refreshed in the background instead of counted per request
+feed_count_cache = RefreshingValue(lambda: db.explore_feed.estimated_document_count(), ttl=30)
+
+
+def feed_rank(created_ts: float, downloads: int) -> float:
+    # Newer first, popular animations stay on top for longer
+    return created_ts / FEED_RANK_SECONDS + math.log10(max(downloads, 1))
+
+
+class FeedRepository:
+    """
+    The explore feed, materialized in the `explore_feed` collection: one entry
+    per public animation with its author's name and avatar copied in, ordered
+    by `rank`. Entries are written when animations are created, downloaded or
+    deleted and when authors change, so a feed page is a single range read on
+    the (rank, _id) index.
+    """
+
+    @staticmethod
+    async def add_animation(animation: dict, author: dict = None):
+        # `animation` as stored, with its "id"; `author` from UserRepository.get_authors_by_ids
+        animation_id = ObjectId(animation["id"])
+        created_ts = animation_id.generation_time.timestamp()
+        downloads = animation.get("downloads", 0)
+        entry = {
+            "animationName": animation.get("animationName", ""),
+            "author_id": animation.get("author_id", ""),
+            "author_name": (author or {}).get("name", ""),
+            "author_avatar_file_id": (author or {}).get("avatarFileId"),
+            "thumbnailFileId": animation.get("thumbnailFileId"),
+            "thumbnail": animation.get("thumbnail", ""),
+            "created_at": animation.get("created_at", ""),
+            "physicalWidth": animation.get("physicalWidth", ""),
+            "physicalHeight": animation.get("physicalHeight", ""),
+            "downloads": downloads,
+            "created_ts": created_ts,
+            "rank": feed_rank(created_ts, downloads),
+        }
+        await db.explore_feed.replace_one({"_id": animation_id}, entry, upsert=True)
+        feed_count_cache.invalidate()
+
+    @staticmethod
+    async def add_downloads(downloads: dict):
+        """
+        Adds {animation_id: count} to the entries with one bulk_write, the rank
+        is raised in the same update. Private animations have no entry and are
+        skipped.
+        """
+        operations = [
+            UpdateOne({"_id": ObjectId(animation_id)}, [
+                {"$set": {"downloads": {"$add": [{"$ifNull": ["$downloads", 0]}, count]}}},
+                {"$set": {"rank": {"$add": [
+                    {"$divide": ["$created_ts", FEED_RANK_SECONDS]},
+                    {"$log10": {"$max": ["$downloads", 1]}},
+                ]}}},
+            ])
+            for animation_id, count in downloads.items()
+        ]
+        if operations:
+            await db.explore_feed.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    async def update_author(user_id: str, author: dict):
+        # Copies a changed name or avatar ({"name": ..., "avatarFileId": ...}) into the author's entries
+        update = {}
+        if "name" in author:
+            update["author_name"] = author["name"] or ""
+        if "avatarFileId" in author:
+            update["author_avatar_file_id"] = author["avatarFileId"]
+        if update:
+            await db.explore_feed.update_many({"author_id": user_id}, {"$set": update})
+
+    @staticmethod
+    async def clear_authors():
+        # All users were deleted
+        await db.explore_feed.update_many({}, {"$set": {"author_name": "", "author_avatar_file_id": None}})
+
+    @staticmethod
+    async def clear():
+        await db.explore_feed.delete_many({})
+        feed_count_cache.invalidate()
+
+    @staticmethod
+    async def get_page(limit: int = 10, after=None, offset: int = 0):
+        """
+        Best ranked entries first. `after` is the (rank, id) of the last entry
+        of the previous page, deep pages cost the same as the first one.
+        Returns the page and whether there are more entries after it.
+        """
+        query = {}
+        if after:
+            rank, last_id = after
+            query = {"$or": [{"rank": {"$lt": rank}}, {"rank": rank, "_id": {"$lt": last_id}}]}
+        projection = {field: 1 for field in FEED_FIELDS}
+        projection["rank"] = 1
+        entries = await db.explore_feed.find(query, projection) \
+            .sort([("rank", -1), ("_id", -1)]).skip(offset).limit(limit + 1).to_list(length=None)
+        for entry in entries:
+            entry["id"] = str(entry.pop("_id"))
+        return entries[:limit], len(entries) > limit
+
+    @staticmethod
+    async def get_total_count():
+        return await feed_count_cache.get()
+
+    @staticmethod
+    async def rebuild():
+        """
+        Builds the feed from the animations collection on the server, used when
+        the feed is empty at startup (first deployment or after it was dropped).
+        """
+        created_ts = {"$divide": [{"$toLong": {"$toDate": "$_id"}}, 1000]}
+        downloads = {"$ifNull": ["$downloads", 0]}
+        await db.animations.aggregate([
+            {"$match": {"isPublic": True}},
+            {"$addFields": {"author_oid": {"$convert": {"input": "$author_id", "to": "objectId", "onError": None, "onNull": None}}}},
+            {"$lookup": {
+                "from": "users", "localField": "author_oid", "foreignField": "_id", "as": "author",
+                "pipeline": [{"$project": {"name": 1, "avatarFileId": 1}}],
+            }},
+            {"$project": {
+                "animationName": {"$ifNull": ["$animationName", ""]},
+                "author_id": {"$ifNull": ["$author_id", ""]},
+                "author_name": {"$ifNull": [{"$first": "$author.name"}, ""]},
+                "author_avatar_file_id": {"$first": "$author.avatarFileId"},
+                "thumbnailFileId": 1,
+                "thumbnail": {"$ifNull": ["$thumbnail", ""]},
+                "created_at": {"$ifNull": ["$created_at", ""]},
+                "physicalWidth": {"$ifNull": ["$physicalWidth", ""]},
+                "physicalHeight": {"$ifNull": ["$physicalHeight", ""]},
+                "downloads": downloads,
+                "created_ts": created_ts,
+                "rank": {"$add": [{"$divide": [created_ts, FEED_RANK_SECONDS]}, {"$log10": {"$max": [downloads, 1]}}]},
+            }},
+            {"$merge": {"into": "explore_feed", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]).to_list(length=None)
+        feed_count_cache.invalidate()
+
+    @staticmethod
+    async def ensure_built():
+        # Cheap check at startup, the feed is only built when it is empty but public animations exist
+        if await db.explore_feed.find_one({}, {"_id": 1}):
+            return
+        if await db.animations.find_one({"isPublic": True}, {"_id": 1}):
+            await FeedRepository.rebuild()
@@ -0,0 +1,169 @@
+from ..core.database import async_db as db, async_grid_fs as grid_fs
+from ..core.config import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES
+from ..core.metrics import gridfs_bytes_written
+from bson import ObjectId
+from gridfs.errors import NoFile
+from io import BytesIO
+from pymongo import ReturnDocument
+import hashlib
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class FileRepository:
+    """
+    Files stored in GridFS. Identical content is stored once and reference counted,
+    derived files (resized thumbnails, ...) are stored next to their source and
+    identified by the source file id and a variant name.
+    """
+
+    @staticmethod
+    async def save_file_to_gridfs(upload_file, max_size: int = MAX_UPLOAD_BYTES):
+        """
+        Streams the upload into GridFS while hashing it, so it is never held
+        in memory as a whole. Content that is already stored is not kept twice,
+        the existing file gets one more reference and its id is returned.
+        Raises UploadTooLarge as soon as more than `max_size` bytes arrive.
+        """
+        if upload_file.size is not None and upload_file.size > max_size:
+            raise UploadTooLarge(f"{upload_file.filename} is larger than {max_size} bytes")
+
+        grid_in = grid_fs.open_upload_stream(
+            upload_file.filename,
+            metadata={"contentType": upload_file.content_type}
+        )
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(f"{upload_file.filename} is larger than {max_size} bytes")
+                sha256.update(chunk)
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        gridfs_bytes_written.inc(amount=size)
+        digest = sha256.hexdigest()
+
+        # Same bytes with the same content type stored already, share that file
+        existing = await db["fs.files"].find_one_and_update(
+            {
+                "metadata.sha256": digest,
+                "metadata.contentType": upload_file.content_type,
+                # a file whose last reference was released is being deleted, it is not reused
+                "metadata.refCount": {"$gte": 1},
+                "_id": {"$ne": grid_in._id}
+            },
+            {"$inc": {"metadata.refCount": 1}},
+            projection={"_id": 1}
+        )
+        if existing:
+            await grid_fs.delete(grid_in._id)
+            return existing["_id"]
+
+        await db["fs.files"].update_one(
+            {"_id": grid_in._id},
+            {"$set": {"metadata.sha256": digest, "metadata.refCount": 1}}
+        )
+        return grid_in._id
+
+    @staticmethod
+    async def save_bytes(data: bytes, filename: str, content_type: str, max_size: int = MAX_UPLOAD_BYTES):
+        # Same as save_file_to_gridfs for content that is already in memory
+        return await FileRepository.save_file_to_gridfs(_BytesUpload(data, filename, content_type), max_size)
+
+    @staticmethod
+    async def release_file(file_id):
+        # Drops one reference to a stored file and deletes it once nothing uses it
+        file = await db["fs.files"].find_one_and_update(
+            {"_id": ObjectId(file_id)},
+            {"$inc": {"metadata.refCount": -1}},
+            projection={"metadata.refCount": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if file and file.get("metadata", {}).get("refCount", 0) <= 0:
+            # The file document is only deleted while it still has no references, in
+            # the same step, then its chunks (what GridFSBucket.delete does in two steps)
+            result = await db["fs.files"].delete_one({"_id": file["_id"], "metadata.refCount": {"$lte": 0}})
+            if result.deleted_count:
+                await db["fs.chunks"].delete_many({"files_id": file["_id"]})
+                await FileRepository.delete_derivatives(file["_id"])
+
+    @staticmethod
+    async def get_file(file_id):
+        # Open a download stream, the content is read by the caller
+        grid_out = await grid_fs.open_download_stream(ObjectId(file_id))
+        return grid_out
+
+    @staticmethod
+    async def get_content_hash(file_id):
+        # SHA-256 of a file stored through save_file_to_gridfs, None for older files
+        file = await db["fs.files"].find_one({"_id": ObjectId(file_id)}, {"metadata.sha256": 1})
+        return (file.get("metadata") or {}).get("sha256") if file else None
+
+    @staticmethod
+    async def file_exists(file_id):
+        return await db["fs.files"].count_documents({"_id": ObjectId(file_id)}, limit=1) > 0
+
+    @staticmethod
+    def get_content_type(grid_out):
+        # Files uploaded through the bucket API keep the content type in metadata,
+        # older files stored with GridFS.put() have it as a top level field
+        metadata = grid_out.metadata or {}
+        return metadata.get("contentType") or grid_out.content_type
+
+    @staticmethod
+    async def get_derivative_id(source_id: str, variant: str):
+        file = await db["fs.files"].find_one(
+            {"metadata.derivativeOf": ObjectId(source_id), "metadata.variant": variant},
+            {"_id": 1}
+        )
+        return file["_id"] if file else None
+
+    @staticmethod
+    async def get_derivative_ids(source_id: str, variants):
+        # {variant: id} of the given variants that exist, one query
+        files = db["fs.files"].find(
+            {"metadata.derivativeOf": ObjectId(source_id), "metadata.variant": {"$in": list(variants)}},
+            {"metadata.variant": 1}
+        )
+        return {file["metadata"]["variant"]: file["_id"] async for file in files}
+
+    @staticmethod
+    async def save_derivative(source_id: str, variant: str, data: bytes, content_type: str, filename: str):
+        gridfs_bytes_written.inc(amount=len(data))
+        return await grid_fs.upload_from_stream(
+            filename,
+            data,
+            metadata={
+                "contentType": content_type,
+                "derivativeOf": ObjectId(source_id),
+                "variant": variant
+            }
+        )
+
+    @staticmethod
+    async def delete_derivatives(source_id):
+        files = db["fs.files"].find({"metadata.derivativeOf": ObjectId(source_id)}, {"_id": 1})
+        async for file in files:
+            try:
+                await grid_fs.delete(file["_id"])
+            except NoFile:
+                pass
+
+
+class _BytesUpload:
+    # Minimal UploadFile look-alike over in-memory bytes
+    def __init__(self, data: bytes, filename: str, content_type: str):
+        self._stream = BytesIO(data)
+        self.filename = filename
+        self.content_type = content_type
+        self.size = len(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
@@ -0,0 +1,44 @@
+from ..core.database import async_db as db
+from ..core.cache import LRUCache
+from ..core.config import GARMENT_UID_CACHE_TTL, GARMENT_UID_NEGATIVE_CACHE_TTL
+
+# uid -> {"user_id", "garment"} or NOT_FOUND, shared by all requests of this process
+garment_uid_cache = LRUCache(maxsize=50000, ttl=GARMENT_UID_CACHE_TTL)
+
+NOT_FOUND = object()
+
+
+class GarmentRepository:
+
+    @staticmethod
+    async def get_by_uid(uid: str):
+        """
+        Resolves a scanned garment uid to {"user_id", "garment"} or None.
+        Served from the in-process cache when possible, otherwise one lookup on
+        the unique garments.uid index that only returns the matching garment.
+        """
+        cached = garment_uid_cache.get(uid)
+        if cached is NOT_FOUND:
+            return None
+        if cached is not None:
+            return cached
+
+        user = await db.users.find_one(
+            {"garments.uid": uid},
+            {"garments": {"$elemMatch": {"uid": uid}}}
+        )
+        if not user or not user.get("garments"):
+            garment_uid_cache.set(uid, NOT_FOUND, ttl=GARMENT_UID_NEGATIVE_CACHE_TTL)
+            return None
+
+        resolved = {"user_id": str(user["_id"]), "garment": user["garments"][0]}
+        garment_uid_cache.set(uid, resolved)
+        return resolved
+
+    @staticmethod
+    def invalidate(uid: str = None):
+        # Without a uid every cached resolution is dropped (user deleted, garments replaced)
+        if uid is None:
+            garment_uid_cache.clear()
+        else:
+            garment_uid_cache.invalidate(uid)
@@ -0,0 +1,75 @@
+from ..core.database import async_db as db
+from .file_repository import FileRepository
+from bson import ObjectId
+from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Job states, shared with the worker in usdz_conversion/main.py
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Conversions the worker knows, by the content type / extension of an upload
+CONVERSION_KINDS = {
+    "image/gif": "gif",
+    ".gif": "gif",
+    "video/mp4": "video",
+    "video/quicktime": "video",
+    ".mp4": "video",
+    ".mov": "video",
+    "model/vnd.usdz+zip": "usdz",
+    ".usdz": "usdz",
+}
+
+
+def conversion_kind(content_type: str, filename: str):
+    # None when the upload is used as it is
+    extension = "." + filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+    return CONVERSION_KINDS.get(content_type or "") or CONVERSION_KINDS.get(extension)
+
+
+class ConversionJobRepository:
+
+    @staticmethod
+    async def enqueue(source_file_id, kind: str):
+        """
+        Queues the conversion of a stored file and returns the job id.
+        Identical content (same SHA-256) shares one job, so a file uploaded
+        again is not converted again. A failed job, or a finished one whose
+        source file was deleted in the meantime, is queued again for this copy.
+        """
+        source_id = ObjectId(source_file_id)
+        digest = await FileRepository.get_content_hash(source_id)
+        key = f"{kind}:{digest or source_id}"
+        now = datetime.utcnow()
+        try:
+            job = await db.conversion_jobs.find_one_and_update(
+                {"key": key},
+                {"$setOnInsert": {
+                    "key": key, "kind": kind, "sourceFileId": source_id, "status": QUEUED,
+                    "progress": 0, "attempts": 0, "created_at": now, "updated_at": now
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # a concurrent upload of the same content created it first
+            job = await db.conversion_jobs.find_one({"key": key})
+
+        # a failed job is retried, also for the same (deduplicated) file. Outputs are
+        # stored with the job's source file, they are gone once it is deleted
+        if job["status"] == FAILED or (
+            job["status"] == DONE and job["sourceFileId"] != source_id
+            and not await FileRepository.file_exists(job["sourceFileId"])
+        ):
+            await db.conversion_jobs.update_one(
+                {"_id": job["_id"], "status": job["status"], "sourceFileId": job["sourceFileId"]},
+                {
+                    "$set": {"sourceFileId": source_id, "status": QUEUED, "progress": 0, "attempts": 0, "updated_at": now},
+                    "$unset": {"outputs": "", "error": ""}
+                }
+            )
+        return job["_id"]
+
+    @staticmethod
+    async def get_job(job_id):
+        return await db.conversion_jobs.find_one({"_id": ObjectId(job_id)})
@@ -0,0 +1,15 @@
+from typing import Iterable, Optional
+
+
+def id_projection(fields: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()):
+    """
+    Aggregation stages that expose `_id` as a string `id`, so results need no
+    per-document remapping in Python. With `fields` only those are returned,
+    otherwise everything except `exclude`.
+    """
+    if fields:
+        return [{"$project": {"_id": 0, "id": {"$toString": "$_id"}, **{field: 1 for field in fields}}}]
+    return [
+        {"$addFields": {"id": {"$toString": "$_id"}}},
+        {"$project": {"_id": 0, **{field: 0 for field in exclude}}},
+    ]
@@ -1,90 +1,386 @@
-from ..core.database import db
+from ..core.database import async_db as db
+from ..core.cache import LRUCache
+from ..core.config import AUTHOR_CACHE_TTL, SEARCH_INDEX_REBUILD, SEARCH_INDEX_REFRESH, STREAM_BATCH_SIZE
+from ..core.response_cache import response_cache
+from ..core.search_index import PrefixIndex
 from ..models.garments_model import Garment, GarmentCreate
+from .feed_repository import FeedRepository
+from .file_repository import FileRepository
+from .garment_repository import GarmentRepository
+from .projection import id_projection
+import base64
+import binascii
 import datetime
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Fields shown next to an animation in the explore feed
+AUTHOR_PROJECTION = {"name": 1, "avatarFileId": 1}
+
+# Inline avatars of not yet migrated users are never loaded with the user
+USER_EXCLUDED_FIELDS = ("imageBase64",)
+
+# Fields of the user list view
+USER_SUMMARY_FIELDS = ("name", "avatarFileId")
+
+# Fields of a full user in lists, avatarFileId becomes the avatarUrl
+USER_LIST_FIELDS = ("name", "description", "joinedDate", "garments", "avatarFileId")
+
+# Author summaries by user id, shared by all requests of this process. Expire, so
+# changes made through other worker processes are picked up
+author_cache = LRUCache(maxsize=2048, ttl=AUTHOR_CACHE_TTL)
+
+# Fields of the authenticated user handed to the routes
+PRINCIPAL_FIELDS = ("name",)
+
+# Authenticated users by user id, entries expire with the TTL given on load
+principal_cache = LRUCache(maxsize=4096)
 
 
 class UserRepository:
 
     @staticmethod
-    def get_all_users():
-        # this is not the ideal way to do this, but it works for now
-        # maybe use _id instead of id and ignore it when returning the data
-        users = list(db.users.find())
-        for user in users:
-            user['id'] = str(user['_id'])
-            del user['_id']
-        return users
+    async def get_all_users(fields=None):
+        # `fields` limits the returned fields, the id is always included
+        pipeline = id_projection(fields, exclude=USER_EXCLUDED_FIELDS)
+        return await db.users.aggregate(pipeline).to_list(length=None)
+
+    @staticmethod
+    def iter_all_users(fields=None):
+        # Cursor over all users for streaming, fetched STREAM_BATCH_SIZE documents at a time
+        pipeline = id_projection(fields, exclude=USER_EXCLUDED_FIELDS)
+        return db.users.aggregate(pipeline, batchSize=STREAM_BATCH_SIZE)
  
-    # src/repositories/user_repository.py
     @staticmethod
-    def get_user_by_id(user_id: str):
-        from bson import ObjectId
-        user = db.users.find_one({"_id": ObjectId(user_id)})
-        if user:
-            user['id'] = str(user['_id'])
-            del user['_id']
-        return user
+    async def get_user_by_id(user_id: str, fields=None):
+        pipeline = [
+            {"$match": {"_id": ObjectId(user_id)}},
+            {"$limit": 1},
+            *id_projection(fields, exclude=USER_EXCLUDED_FIELDS)
+        ]
+        users = await db.users.aggregate(pipeline).to_list(length=1)
+        return users[0] if users else None
     
     @staticmethod
-    def get_user_by_name(name: str):
-        user = db.users.find_one({"name": name})
-        if user:
-            user['id'] = str(user['_id'])
-            del user['_id']
+    async def get_principal(user_id: str, ttl: float):
+        """
+        Slim user of an access token, kept for `ttl` seconds.
+        Unknown users are not cached, so they are rejected until they exist.
+        """
+        user = principal_cache.get(user_id)
+        if user is None:
+            if not ObjectId.is_valid(user_id):
+                return None
+            user = await UserRepository.get_user_by_id(user_id, fields=PRINCIPAL_FIELDS)
+            if user and ttl > 0:
+                principal_cache.set(user_id, user, ttl)
         return user
+
+    @staticmethod
+    async def get_authors_by_ids(user_ids):
+        """
+        Returns {user_id: author} for the given ids with one projected $in query
+        for the authors that are not cached yet. Unknown ids are left out.
+        """
+        authors = {}
+        missing = []
+        for user_id in set(user_ids):
+            author = author_cache.get(user_id)
+            if author is not None:
+                authors[user_id] = author
+            elif ObjectId.is_valid(user_id):
+                missing.append(ObjectId(user_id))
+
+        if missing:
+            cursor = db.users.find({"_id": {"$in": missing}}, AUTHOR_PROJECTION)
+            async for user in cursor:
+                user_id = str(user.pop('_id'))
+                author_cache.set(user_id, user)
+                authors[user_id] = user
+        return authors
+    
+    @staticmethod
+    async def get_user_by_name(name: str):
+        users = await db.users.aggregate([
+            {"$match": {"name": name}},
+            {"$limit": 1},
+            *id_projection(exclude=USER_EXCLUDED_FIELDS)
+        ]).to_list(length=1)
+        return users[0] if users else None
     
     @staticmethod
-    def create_user(user_data: dict):
+    async def create_user(user_data: dict):
         # add today date
         user_data['joinedDate'] = datetime.datetime.now().strftime("%d/%m/%Y")
-        result = db.users.insert_one(user_data)
+        user_data.pop('avatarUrl', None)
+        image_base64 = user_data.pop('imageBase64', None)
+        if image_base64:
+            user_data['avatarFileId'] = await UserRepository.save_base64_avatar(image_base64)
+        result = await db.users.insert_one(user_data)
+        name_index.add(user_data.get('name'))
         
         user_data['id'] = str(result.inserted_id)
+        # insert_one adds the ObjectId to the dict, it is exposed as 'id' instead
+        user_data.pop('_id', None)
         return user_data
-    
-    @staticmethod
-    def update_user(user_id: str, update_data: dict):
-        result = db.users.update_one({"id": user_id}, {"$set": update_data})
-        return result.matched_count > 0
-    
+
     @staticmethod
-    def delete_user(user_id: str):
-        result = db.users.delete_one({"id": user_id})
-        return result.deleted_count > 0
+    async def create_users(users_data: list):
+        """
+        Creates many users with one insert_many. Names already taken (in the
+        database or earlier in the batch) and invalid avatars are reported per item.
+        Returns a list with the created user or an error message for every item.
+        """
+        names = [user_data.get("name") for user_data in users_data]
+        taken = {user["name"] async for user in db.users.find({"name": {"$in": names}}, {"name": 1})}
+
+        results, documents, positions = [], [], []
+        joined_date = datetime.datetime.now().strftime("%d/%m/%Y")
+        for index, user_data in enumerate(users_data):
+            if user_data.get("name") in taken:
+                results.append("Username already registered")
+                continue
+            taken.add(user_data.get("name"))
+            user_data['joinedDate'] = joined_date
+            user_data.pop('avatarUrl', None)
+            image_base64 = user_data.pop('imageBase64', None)
+            try:
+                if image_base64:
+                    user_data['avatarFileId'] = await UserRepository.save_base64_avatar(image_base64)
+            except ValueError as e:
+                results.append(str(e))
+                continue
+            results.append(user_data)
+            documents.append(user_data)
+            positions.append(index)
+
+        failed = {}
+        if documents:
+            try:
+                await db.users.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                failed = {error["index"]: error.get("errmsg", "Insert failed") for error in e.details["writeErrors"]}
+        for document_index, index in enumerate(positions):
+            user_data = results[index]
+            if document_index in failed:
+                if user_data.get("avatarFileId"):
+                    await FileRepository.release_file(user_data["avatarFileId"])
+                results[index] = failed[document_index]
+                continue
+            name_index.add(user_data.get('name'))
+            user_data['id'] = str(user_data.pop('_id'))
+        return results
 
     @staticmethod
-    def delete_all_users():
-        result = db.users.delete_many({})
+    async def delete_all_users():
+        async for user in db.users.find({"avatarFileId": {"$exists": True}}, {"avatarFileId": 1}):
+            await FileRepository.release_file(user["avatarFileId"])
+        result = await db.users.delete_many({})
+        name_index.clear()
+        await FeedRepository.clear_authors()
+        author_cache.clear()
+        principal_cache.clear()
+        GarmentRepository.invalidate()
+        await response_cache.invalidate("user", "authors")
         return result.deleted_count
     
     @staticmethod
-    def add_garment_to_user(user_id: str, garment: GarmentCreate):
-        user = UserRepository.get_user_by_id(user_id)
-        if not user:
-            return None
+    async def add_garment_to_user(user_id: str, garment: GarmentCreate):
+        """
+        Returns the added Garment, or None when the user does not exist.
+        Raises DuplicateKeyError when the uid is linked already, to another
+        user (unique index) or to this one (the index does not cover one array).
+        """
         new_garment = Garment(**garment.model_dump())
 
         # Add the new garment to the user's garments array in the database
-        result = db.users.update_one(
-            {"_id": ObjectId(user_id)},
+        result = await db.users.update_one(
+            {"_id": ObjectId(user_id), "garments.uid": {"$ne": new_garment.uid}},
             {"$push": {"garments": new_garment.model_dump()}}
         )
 
         if result.modified_count == 0:
+            if await db.users.count_documents({"_id": ObjectId(user_id)}, limit=1):
+                raise DuplicateKeyError("Garment uid is already linked", code=11000)
             return None
 
+        GarmentRepository.invalidate(new_garment.uid)
+        await response_cache.invalidate(f"user:{user_id}")
         return new_garment
     
     @staticmethod
-    def update_user(user_id: str, update_data: dict):
-        result = db.users.update_one(
+    async def add_garments_to_user(user_id: str, garments: list):
+        """
+        Links many garments to a user in one bulk_write, one update per garment,
+        so a uid linked in the meantime only fails its own item.
+        Returns None when the user does not exist, otherwise a list with
+        the created Garment or an error message for every item.
+        """
+        uids = [garment.uid for garment in garments]
+        taken = set()
+        async for user in db.users.find({"garments.uid": {"$in": uids}}, {"garments.uid": 1}):
+            taken.update(linked["uid"] for linked in user.get("garments", []))
+
+        results, operations, positions = [], [], []
+        for index, garment in enumerate(garments):
+            if garment.uid in taken:
+                results.append("Garment uid is already linked")
+                continue
+            taken.add(garment.uid)
+            new_garment = Garment(**garment.model_dump())
+            results.append(new_garment)
+            operations.append(UpdateOne(
+                {"_id": ObjectId(user_id), "garments.uid": {"$ne": garment.uid}},
+                {"$push": {"garments": new_garment.model_dump()}}
+            ))
+            positions.append(index)
+
+        if not operations:
+            exists = await db.users.count_documents({"_id": ObjectId(user_id)}, limit=1)
+            return results if exists else None
+
+        failed = {}
+        try:
+            result = await db.users.bulk_write(operations, ordered=False)
+            matched = result.matched_count
+        except BulkWriteError as e:
+            failed = {error["index"]: "Garment uid is already linked" for error in e.details["writeErrors"]}
+            matched = e.details.get("nMatched", 0)
+        if matched + len(failed) < len(operations):
+            # The user is gone, or the uid filter skipped uids linked to it in the meantime
+            user = await db.users.find_one({"_id": ObjectId(user_id)}, {"garments.id": 1})
+            if user is None:
+                return None
+            linked = {linked.get("id") for linked in user.get("garments", [])}
+            for operation_index, index in enumerate(positions):
+                if operation_index not in failed and results[index].id not in linked:
+                    failed[operation_index] = "Garment uid is already linked"
+
+        for operation_index, index in enumerate(positions):
+            if operation_index in failed:
+                results[index] = failed[operation_index]
+            else:
+                GarmentRepository.invalidate(results[index].uid)
+        await response_cache.invalidate(f"user:{user_id}")
+        return results
+
+    @staticmethod
+    async def update_user(user_id: str, update_data: dict):
+        """
+        Raises ValueError for invalid input and DuplicateKeyError when a garment
+        uid is linked to another user already.
+        """
+        uids = [garment["uid"] for garment in update_data.get("garments") or []]
+        if len(uids) != len(set(uids)):
+            raise ValueError("Garment uids must be unique")
+        image_base64 = update_data.pop('imageBase64', None)
+        if image_base64:
+            avatar_id = await UserRepository.save_base64_avatar(image_base64)
+            if not await UserRepository.set_avatar(user_id, avatar_id):
+                return False
+            if not update_data:
+                return True
+        result = await db.users.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": update_data}
         )
+        author_cache.invalidate(user_id)
+        principal_cache.invalidate(user_id)
+        if "name" in update_data:
+            name_index.add(update_data["name"])
+            await FeedRepository.update_author(user_id, {"name": update_data["name"]})
+        await response_cache.invalidate(f"user:{user_id}", "authors")
+        if "garments" in update_data:
+            GarmentRepository.invalidate()
         return result.matched_count > 0
 
     @staticmethod
-    def delete_user(user_id: str):
-        result = db.users.delete_one({"_id": ObjectId(user_id)})
-        return result.deleted_count > 0
\ No newline at end of file
+    async def delete_user(user_id: str):
+        user = await db.users.find_one_and_delete({"_id": ObjectId(user_id)}, {"avatarFileId": 1})
+        if user:
+            await FeedRepository.update_author(user_id, {"name": "", "avatarFileId": None})
+        author_cache.invalidate(user_id)
+        principal_cache.invalidate(user_id)
+        await response_cache.invalidate(f"user:{user_id}", "authors")
+        GarmentRepository.invalidate()
+        if user and user.get("avatarFileId"):
+            await FileRepository.release_file(user["avatarFileId"])
+        return user is not None
+
+    @staticmethod
+    async def save_base64_avatar(image_base64: str):
+        """
+        Stores a base64 encoded (optionally data URI) image as an avatar file.
+        Raises ValueError when it is not valid base64.
+        """
+        if image_base64.startswith("data:"):
+            image_base64 = image_base64.split(",", 1)[-1]
+        try:
+            data = base64.b64decode(image_base64, validate=True)
+        except binascii.Error as e:
+            raise ValueError("imageBase64 is not valid base64") from e
+        return await FileRepository.save_bytes(data, "avatar", guess_image_type(data))
+
+    @staticmethod
+    async def set_avatar(user_id: str, avatar_id):
+        # Points the user to a new avatar file and releases the previous one
+        user = await db.users.find_one_and_update(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"avatarFileId": avatar_id}, "$unset": {"imageBase64": ""}},
+            projection={"avatarFileId": 1}
+        )
+        author_cache.invalidate(user_id)
+        await response_cache.invalidate(f"user:{user_id}", "authors")
+        if not user:
+            await FileRepository.release_file(avatar_id)
+            return False
+        await FeedRepository.update_author(user_id, {"avatarFileId": avatar_id})
+        if user.get("avatarFileId") and user["avatarFileId"] != avatar_id:
+            await FileRepository.release_file(user["avatarFileId"])
+        return True
+
+    @staticmethod
+    async def get_avatar_file_id(user_id: str):
+        """
+        Returns (user exists, avatar file id or None).
+        Users created before avatars were files still have an inline imageBase64,
+        it is moved to GridFS on the first request.
+        """
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, {"avatarFileId": 1, "imageBase64": 1})
+        if not user:
+            return False, None
+        if not user.get("avatarFileId") and user.get("imageBase64"):
+            try:
+                avatar_id = await UserRepository.save_base64_avatar(user["imageBase64"])
+            except ValueError:
+                return True, None
+            await UserRepository.set_avatar(user_id, avatar_id)
+            return True, avatar_id
+        return True, user.get("avatarFileId")
+
+    @staticmethod
+    async def iter_names(after_id=None):
+        # (id, name) of all users, created after `after_id` when given
+        query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+        async for user in db.users.find(query, {"name": 1}, batch_size=STREAM_BATCH_SIZE):
+            yield user["_id"], user.get("name")
+
+
+# User names for autocomplete
+name_index = PrefixIndex(UserRepository.iter_names, SEARCH_INDEX_REFRESH, SEARCH_INDEX_REBUILD)
+
+
+def guess_image_type(data: bytes) -> str:
+    # Content type from the file signature, avatars are sent without one
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return "application/octet-stream"
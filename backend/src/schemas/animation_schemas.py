@@ -16,4 +16,32 @@ class AnimationResponse(AnimationCreate):
     author_id: str
     animationFileId: Optional[str] = None
     created_at: Optional[str] = None
-    links: Optional[List[Link]] = None
\ No newline at end of file
+    # written in batches and not refreshed in cached responses, can lag up to the cache TTL
+    downloads: int = 0
+    views: int = 0
+    links: Optional[List[Link]] = None
+
+class AnimationSummary(BaseModel):
+    # list view of an animation
+    id: str
+    animationName: str
+    author_id: str
+    isPublic: bool
+    created_at: Optional[str] = None
+    links: Optional[List[Link]] = None
+
+class AnimationStatus(BaseModel):
+    # progress of the conversion of an uploaded animation, "ready" when it needs none
+    animation_id: str
+    status: str
+    progress: int = 0
+    error: Optional[str] = None
+    links: List[Link] = []
+
+class AnimationBatchGetRequest(BaseModel):
+    ids: List[str]
+
+class AnimationBatchGetResponse(BaseModel):
+    # found animations in the requested order, ids that do not exist are listed in missing
+    animations: List[AnimationResponse] = []
+    missing: List[str] = []
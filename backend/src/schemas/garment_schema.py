@@ -11,4 +11,22 @@ class GarmentResponse(GarmentCreate):
     id: str
     author_id: str
     created_at: Optional[str] = None
-    links: List[Link] = []  # Added links field
\ No newline at end of file
+    links: List[Link] = []  # Added links field
+
+class GarmentResolution(BaseModel):
+    # owner (and animation) of a scanned garment uid
+    uid: str
+    garment: Garment
+    owner_id: str
+    owner_name: Optional[str] = None
+    owner_avatar_url: Optional[str] = None
+    animation_id: Optional[str] = None
+    links: List[Link] = []
+
+class GarmentCodeDecode(BaseModel):
+    # glyph code read from a photo, uid is the decimal 64-bit value
+    uid: str
+    code: str
+    confidence: float
+    scores: List[float] = []
+    links: List[Link] = []
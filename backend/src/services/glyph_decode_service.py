@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional
+
+from ..core.config import GLYPH_BATCH_SIZE, GLYPH_BATCH_WINDOW, GLYPH_TEMPLATES_DIR
+from .glyph_recognition import GlyphRecognizer
+
+
+class GlyphDecodeService:
+    _recognizer: Optional[GlyphRecognizer] = None
+    # photos waiting for the next batch, with the futures of their requests
+    _queue = []
+    _flush_handle = None
+
+    @classmethod
+    def _get_recognizer(cls) -> GlyphRecognizer:
+        # The template bank is built on the first decode and reused afterwards
+        if cls._recognizer is None:
+            cls._recognizer = GlyphRecognizer(GLYPH_TEMPLATES_DIR)
+        return cls._recognizer
+
+    @classmethod
+    def _recognize_batch(cls, images):
+        return cls._get_recognizer().recognize_batch(images)
+
+    @classmethod
+    async def decode(cls, data: bytes) -> dict:
+        """
+        Recognizes the glyph code in a photo. Concurrent requests are collected
+        for GLYPH_BATCH_WINDOW seconds (or until GLYPH_BATCH_SIZE photos) and
+        decoded as one batch in a worker thread.
+        Raises RecognitionError when the photo holds no readable code.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        cls._queue.append((data, future))
+        if len(cls._queue) >= GLYPH_BATCH_SIZE:
+            cls._flush()
+        elif cls._flush_handle is None:
+            cls._flush_handle = loop.call_later(GLYPH_BATCH_WINDOW, cls._flush)
+
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @classmethod
+    def _flush(cls):
+        if cls._flush_handle is not None:
+            cls._flush_handle.cancel()
+            cls._flush_handle = None
+        batch, cls._queue = cls._queue, []
+        if batch:
+            asyncio.ensure_future(cls._run(batch))
+
+    @classmethod
+    async def _run(cls, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(None, cls._recognize_batch, [data for data, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
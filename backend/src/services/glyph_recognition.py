@@ -0,0 +1,239 @@
+"""
+Recognition of printed 64-bit glyph codes from photos.
+
+A code is a grid of 16 symbol glyphs (8 x 2 by default, the layout of
+encoding_generation/render_mockups.py), each glyph is one nibble of the UID,
+most significant first. The photo is binarized, the grid cells are located
+from ink projection profiles and every cell is classified by normalized
+cross-correlation against a bank of reference templates at several scales.
+All cells of all images in a batch are matched with a single matrix product.
+
+This module only depends on NumPy and Pillow, so the offline tools in
+encoding_generation/ can import it as well.
+"""
+import os
+from io import BytesIO
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# glyph index == nibble value, the first 16 symbols of encoding_generation/characters/ in
+# sorted order. The only copy of the table, encoding_generation/render_mockups.py imports it
+GLYPH_NAMES = [
+    "ciarka", "dve_vlnky", "dvoj_trojuholnik", "dvojita_sipka",
+    "hebrejsky_znak", "kruh_v_kruhu", "list", "lopta",
+    "naopak_trojuholnicek", "oko_2", "plus_kruh", "polkruh",
+    "radiacia_pozor", "srdiecko", "stromcek", "vertikalne_paralelne_ciary",
+]
+# scanned glyph images that are saved under a different name than the SVG
+JPEG_NAMES = {"hebrejsky_znak": "hebresky_znak"}
+TEMPLATE_FILES = {name: f"{JPEG_NAMES.get(name, name)}.jpeg" for name in GLYPH_NAMES}
+
+# the same 16 glyphs as characters, see design_mockups/iteration_1/japanese_decode.py
+KANJI = "日手目口木竹糸川山石火水刀土空月"
+CODE_LENGTH = 16
+
+FEATURE_SIZE = 32
+TEMPLATE_SCALES = (1.0, 0.9, 0.8)
+MAX_IMAGE_SIDE = 1024
+
+
+class RecognitionError(ValueError):
+    pass
+
+
+def _otsu_threshold(gray: np.ndarray) -> float:
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_background = np.cumsum(histogram)
+    weight_foreground = weight_background[-1] - weight_background
+    mean_background = np.cumsum(histogram * levels) / np.maximum(weight_background, 1)
+    mean_foreground = ((histogram * levels).sum() - np.cumsum(histogram * levels)) / np.maximum(weight_foreground, 1)
+    between = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+    return float(np.argmax(between))
+
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    # Dark strokes on a light background
+    return gray <= _otsu_threshold(gray)
+
+
+def _ink_bounds(profile: np.ndarray, min_ink: int):
+    indexes = np.flatnonzero(profile >= min_ink)
+    if len(indexes) == 0:
+        return None
+    return indexes[0], indexes[-1] + 1
+
+
+def _feature(mask: np.ndarray, scale: float = 1.0) -> Optional[np.ndarray]:
+    """
+    Crops a glyph mask to its ink, centers it on a square canvas (scaled by `scale`)
+    and returns the zero-mean, unit-length FEATURE_SIZE^2 vector.
+    """
+    rows = _ink_bounds(mask.sum(axis=1), 1)
+    columns = _ink_bounds(mask.sum(axis=0), 1)
+    if rows is None or columns is None:
+        return None
+    glyph = mask[rows[0]:rows[1], columns[0]:columns[1]]
+    side = int(max(glyph.shape) / scale) + 1
+    canvas = np.zeros((side, side), dtype=np.uint8)
+    top = (side - glyph.shape[0]) // 2
+    left = (side - glyph.shape[1]) // 2
+    canvas[top:top + glyph.shape[0], left:left + glyph.shape[1]] = glyph * 255
+
+    resized = Image.fromarray(canvas).resize((FEATURE_SIZE, FEATURE_SIZE), Image.BOX)
+    # a little blur makes the correlation tolerant to stroke width and small shifts
+    resized = resized.filter(ImageFilter.GaussianBlur(1))
+    vector = np.asarray(resized, dtype=np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def _to_gray(image) -> np.ndarray:
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(BytesIO(image))
+    if isinstance(image, Image.Image):
+        image = image.convert("L")
+        if max(image.size) > MAX_IMAGE_SIDE:
+            image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        return np.asarray(image, dtype=np.uint8)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def _split_points(profile: np.ndarray, parts: int) -> List[int]:
+    """
+    Boundaries between `parts` equally pitched bands: the expected boundary is
+    moved into the middle of the emptiest gap within a third of a pitch around it.
+    """
+    pitch = len(profile) / parts
+    window = max(1, int(pitch / 3))
+    points = [0]
+    for index in range(1, parts):
+        expected = int(index * pitch)
+        low, high = max(0, expected - window), min(len(profile), expected + window + 1)
+        emptiest = np.flatnonzero(profile[low:high] == profile[low:high].min()) + low
+        # the gap is the run of emptiest positions closest to the expected boundary
+        runs = np.split(emptiest, np.flatnonzero(np.diff(emptiest) != 1) + 1)
+        gap = min(runs, key=lambda run: np.abs(run - expected).min())
+        points.append(int(gap[len(gap) // 2]))
+    points.append(len(profile))
+    return points
+
+
+def segment_cells(gray: np.ndarray, columns: int = 8, rows: int = 2) -> List[np.ndarray]:
+    """
+    Splits a photo of one code into rows * columns glyph masks in reading order.
+    Raises RecognitionError when no grid of glyphs can be found.
+    """
+    mask = _ink_mask(gray)
+    # ignore specks: a row / column of the code has at least a few ink pixels
+    min_ink = max(2, int(0.002 * max(mask.shape)))
+    row_bounds = _ink_bounds(mask.sum(axis=1), min_ink)
+    column_bounds = _ink_bounds(mask.sum(axis=0), min_ink)
+    if row_bounds is None or column_bounds is None:
+        raise RecognitionError("No glyphs found in the image")
+    code = mask[row_bounds[0]:row_bounds[1], column_bounds[0]:column_bounds[1]]
+
+    row_points = _split_points(code.sum(axis=1), rows)
+    cells = []
+    for top, bottom in zip(row_points, row_points[1:]):
+        band = code[top:bottom]
+        column_points = _split_points(band.sum(axis=0), columns)
+        cells.extend(band[:, left:right] for left, right in zip(column_points, column_points[1:]))
+    return cells
+
+
+class GlyphRecognizer:
+    """
+    Template bank built once from the reference glyph images, then used
+    to classify batches of photos.
+    """
+
+    def __init__(self, templates_dir: str, scales: Sequence[float] = TEMPLATE_SCALES):
+        vectors, labels = [], []
+        for index, name in enumerate(GLYPH_NAMES):
+            with Image.open(os.path.join(templates_dir, TEMPLATE_FILES[name])) as image:
+                mask = _ink_mask(_to_gray(image))
+            for scale in scales:
+                vector = _feature(mask, scale)
+                if vector is not None:
+                    vectors.append(vector)
+                    labels.append(index)
+        # (templates, FEATURE_SIZE^2) matrix, one row per glyph and scale
+        self.templates = np.stack(vectors)
+        self.labels = np.array(labels)
+
+    def classify(self, cells: List[np.ndarray]):
+        """
+        Returns (nibbles, scores) for glyph masks. Scores are the best normalized
+        correlation in [-1, 1], empty cells get nibble -1 and score 0.
+        """
+        features = [_feature(cell) for cell in cells]
+        present = np.array([feature is not None for feature in features])
+        nibbles = np.full(len(cells), -1, dtype=np.int8)
+        scores = np.zeros(len(cells), dtype=np.float32)
+        if present.any():
+            matrix = np.stack([feature for feature in features if feature is not None])
+            correlation = matrix @ self.templates.T
+            best = correlation.argmax(axis=1)
+            nibbles[present] = self.labels[best]
+            scores[present] = correlation[np.arange(len(best)), best]
+        return nibbles, scores
+
+    def recognize_batch(self, images, columns: int = 8, rows: int = 2):
+        """
+        Recognizes one code per image (PIL image, bytes or grayscale array).
+        Returns a list with a result dict per image, or a RecognitionError
+        for images without a readable code.
+        """
+        cells, owners, results = [], [], []
+        for position, image in enumerate(images):
+            try:
+                image_cells = segment_cells(_to_gray(image), columns, rows)
+            except RecognitionError as e:
+                results.append(e)
+                continue
+            except Exception:
+                # Any decode failure (corrupt data, decompression bomb, odd mode) only fails its own image
+                results.append(RecognitionError("Not a readable image"))
+                continue
+            results.append(None)
+            cells.extend(image_cells)
+            owners.extend([position] * len(image_cells))
+
+        # all cells of the batch are matched at once
+        nibbles, scores = self.classify(cells)
+        owners = np.array(owners, dtype=np.int64)
+        for position, result in enumerate(results):
+            if result is not None:
+                continue
+            code_nibbles = nibbles[owners == position]
+            code_scores = scores[owners == position]
+            if (code_nibbles < 0).any() or len(code_nibbles) != CODE_LENGTH:
+                results[position] = RecognitionError("Could not read all 16 glyphs")
+                continue
+            results[position] = {
+                "uid": nibbles_to_number(code_nibbles),
+                "code": "".join(KANJI[nibble] for nibble in code_nibbles),
+                "nibbles": code_nibbles.tolist(),
+                "confidence": float(code_scores.min()),
+                "scores": code_scores.round(3).tolist(),
+            }
+        return results
+
+    def recognize(self, image, columns: int = 8, rows: int = 2) -> dict:
+        # Single image, raises RecognitionError when it can not be read
+        result = self.recognize_batch([image], columns, rows)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def nibbles_to_number(nibbles) -> int:
+    # Inverse of the nibble split, same value as japanese_to_number() of the kanji code
+    value = 0
+    for nibble in nibbles:
+        value = (value << 4) | int(nibble)
+    return value
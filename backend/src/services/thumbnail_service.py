@@ -0,0 +1,140 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from ..core.config import THUMBNAIL_WORKERS
+from ..core.logger import logger
+from ..core.metrics import gridfs_bytes_read
+from ..repositories.file_repository import FileRepository
+
+# Longest edge in pixels of every derivative size
+THUMBNAIL_SIZES = {
+    "small": 160,
+    "medium": 320,
+    "large": 640,
+}
+
+# Preferred first, only formats supported by the installed Pillow are offered
+FORMATS = [
+    ("avif", "image/avif", "AVIF"),
+    ("webp", "image/webp", "WEBP"),
+    ("jpeg", "image/jpeg", "JPEG"),
+]
+SUPPORTED_FORMATS = [fmt for fmt in FORMATS if fmt[0] == "jpeg" or features.check(fmt[0])]
+
+# Errors of sources Pillow cannot decode: unknown, truncated or corrupt data, odd modes,
+# decompression bombs. Any other failure is not stored, the next request tries again
+UNRENDERABLE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError, SyntaxError)
+
+# Variant of the empty marker stored for sources Pillow cannot read, so they are not read again
+NOT_RENDERABLE = "not-renderable"
+
+
+def render_derivative(data: bytes, max_edge: int, pil_format: str) -> bytes:
+    # Runs in a worker process, so it only takes and returns plain bytes
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = BytesIO()
+        image.save(output, format=pil_format, quality=80)
+        return output.getvalue()
+
+
+def choose_format(accept: Optional[str]):
+    """
+    Picks the best derivative format the client accepts.
+    JPEG is always acceptable as the fallback.
+    """
+    accept = accept or ""
+    for name, content_type, pil_format in SUPPORTED_FORMATS:
+        if content_type in accept:
+            return name, content_type, pil_format
+    return FORMATS[-1]
+
+
+class ThumbnailService:
+    _pool = None
+    # variants being rendered right now, so concurrent requests wait for one render
+    _pending = {}
+
+    @classmethod
+    def _get_pool(cls):
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+        return cls._pool
+
+    @classmethod
+    def shutdown(cls):
+        if cls._pool is not None:
+            cls._pool.shutdown(wait=False, cancel_futures=True)
+            cls._pool = None
+
+    @classmethod
+    async def get_derivative_id(cls, grid_out, size: str, accept: Optional[str] = None):
+        """
+        Returns the GridFS id of `grid_out` resized to `size` in the best format
+        for the `accept` header. It is rendered in the process pool the first time
+        and stored in GridFS for later requests. Returns None when the source
+        is not an image Pillow can read.
+        """
+        name, content_type, pil_format = choose_format(accept)
+        variant = f"{size}.{name}"
+        source_id = grid_out._id
+
+        found = await FileRepository.get_derivative_ids(source_id, (variant, NOT_RENDERABLE))
+        if variant in found:
+            return found[variant]
+        if NOT_RENDERABLE in found:
+            return None
+
+        key = (source_id, variant)
+        if key not in cls._pending:
+            cls._pending[key] = asyncio.ensure_future(
+                cls._render(source_id, variant, THUMBNAIL_SIZES[size], content_type, pil_format)
+            )
+            cls._pending[key].add_done_callback(lambda _: cls._pending.pop(key, None))
+        return await asyncio.shield(cls._pending[key])
+
+    @classmethod
+    async def prerender(cls, file_id):
+        # Renders every size in the default format right after an upload
+        try:
+            for size in THUMBNAIL_SIZES:
+                grid_out = await FileRepository.get_file(file_id)
+                if await cls.get_derivative_id(grid_out, size) is None:
+                    break
+        except Exception as e:
+            logger.warning(f"Prerendering thumbnails of {file_id} failed: {e}")
+
+    @classmethod
+    async def _render(cls, source_id, variant, max_edge, content_type, pil_format):
+        # Reads its own stream, the caller's one is left unread for serving the original
+        grid_out = await FileRepository.get_file(source_id)
+        data = await grid_out.read()
+        gridfs_bytes_read.inc(amount=len(data))
+        loop = asyncio.get_running_loop()
+        try:
+            rendered = await loop.run_in_executor(cls._get_pool(), render_derivative, data, max_edge, pil_format)
+        except UNRENDERABLE_ERRORS as e:
+            # The source itself cannot be rendered, remembered so it is not read again
+            logger.info(f"{source_id} is not a renderable image: {e!r}")
+            await FileRepository.save_derivative(source_id, NOT_RENDERABLE, b"", "", f"{grid_out.filename}.{NOT_RENDERABLE}")
+            return None
+        except BrokenProcessPool as e:
+            # A render process died, the next render starts a new pool
+            logger.warning(f"Rendering {variant} of {source_id} failed, the process pool is broken: {e!r}")
+            cls._pool = None
+            return None
+        except Exception as e:
+            # Possibly transient, the original is served and the next request tries again
+            logger.warning(f"Rendering {variant} of {source_id} failed: {e!r}")
+            return None
+        return await FileRepository.save_derivative(
+            source_id, variant, rendered, content_type, f"{grid_out.filename}.{variant}"
+        )
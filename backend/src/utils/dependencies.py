@@ -1,22 +1,28 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from .security import decode_access_token
+import time
+from .security import decode_access_token_payload
+from ..core.config import PRINCIPAL_CACHE_TTL
 from ..repositories.user_repository import UserRepository
 
 security = HTTPBearer()
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    user_id = decode_access_token(token)
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = decode_access_token_payload(credentials.credentials)
+    user_id = payload.get("sub") if payload else None
     if not user_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid authentication token",
         )
-    user = UserRepository.get_user_by_id(user_id)
+    # A cached principal never outlives the token it was loaded for
+    ttl = PRINCIPAL_CACHE_TTL
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    user = await UserRepository.get_principal(user_id, ttl)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User not found",
         )
-    return user
\ No newline at end of file
+    return user
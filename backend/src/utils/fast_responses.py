@@ -0,0 +1,79 @@
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi import Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..core.cache import LRUCache
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Lines are sent in chunks of about this size instead of one write per record
+NDJSON_CHUNK_BYTES = 64 * 1024
+
+# Link templates by (base URL, route name), bounded since the Host header comes from clients
+link_templates = LRUCache(maxsize=256)
+
+
+def link_template(request: Request, name: str, param: str) -> str:
+    """
+    URL of route `name` with a "{param}" placeholder, resolved with url_for once
+    per base URL and then filled with str.format for every item of a list.
+    """
+    key = (str(request.base_url), name)
+    template = link_templates.get(key)
+    if template is None:
+        template = str(request.url_for(name, **{param: "{" + param + "}"}))
+        link_templates.set(key, template)
+    return template
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    orjson rendered response for trusted repository output. The route's
+    response_model is only used for the docs, the content is not validated again,
+    so the repository has to project exactly the documented fields.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default)
+
+
+def model_defaults(model) -> dict:
+    # Values pydantic would fill in for fields missing from a document
+    return {
+        name: field.get_default(call_default_factory=True)
+        for name, field in model.model_fields.items()
+        if not field.is_required()
+    }
+
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(records, to_item) -> StreamingResponse:
+    """
+    Streams the documents of an async iterator (a Mongo cursor) as one JSON
+    object per line, converted with `to_item`. Only one cursor batch and one
+    chunk are held in memory, however many documents there are.
+    """
+    async def lines():
+        chunk = bytearray()
+        async for record in records:
+            chunk += orjson.dumps(to_item(record), default=_default)
+            chunk += b"\n"
+            if len(chunk) >= NDJSON_CHUNK_BYTES:
+                yield bytes(chunk)
+                chunk.clear()
+        if chunk:
+            yield bytes(chunk)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
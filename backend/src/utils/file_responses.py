@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from ..core.metrics import gridfs_bytes_read
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def get_etag(grid_out) -> str:
+    # GridFS files are immutable, so the id together with the length identifies
+    # the content. Files with a stored content hash use that instead.
+    metadata = grid_out.metadata or {}
+    digest = metadata.get("sha256") or f"{grid_out._id}-{grid_out.length}"
+    return f'"{digest}"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison as required for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+
+def parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single "bytes=start-end" range into inclusive (start, end) offsets.
+    Returns None when the whole file should be sent and raises ValueError
+    when the range can not be satisfied. Multiple ranges are not supported
+    and are answered with the whole file.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # suffix range: the last N bytes
+        suffix = int(end)
+        if suffix == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(length - suffix, 0), length - 1
+    start = int(start)
+    end = min(int(end), length - 1) if end else length - 1
+    if start >= length or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+async def _iter_gridfs(grid_out, start: int, size: int):
+    # Reads GridFS chunk by chunk, so at most one chunk is held in memory.
+    # Seeks even to 0, the stream may have been read before
+    grid_out.seek(start)
+    remaining = size
+    while remaining > 0:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        gridfs_bytes_read.inc(amount=len(chunk))
+        chunk = chunk[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+
+
+def gridfs_file_response(request: Request, grid_out, media_type: str, filename: str = None, headers: dict = None) -> Response:
+    """
+    Streams a GridFS file with support for ETag / If-None-Match and single byte
+    Range requests (If-Range is honoured), so clients can resume large downloads.
+    """
+    etag = get_etag(grid_out)
+    length = grid_out.length
+    extra_headers = headers or {}
+    headers = {
+        **extra_headers,
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={filename or grid_out.filename}",
+    }
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={**extra_headers, "ETag": etag})
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        # the client has a different version, send the whole file
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, length)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{length}", "ETag": etag})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(_iter_gridfs(grid_out, 0, length), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    size = end - start + 1
+    headers["Content-Length"] = str(size)
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    return StreamingResponse(
+        _iter_gridfs(grid_out, start, size),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+@lru_cache(maxsize=None)
+def _load_static_file(path, base64_encoded: bool):
+    with open(path, "rb") as file:
+        data = file.read()
+    if base64_encoded:
+        data = base64.b64decode(data)
+    return data, f'"{hashlib.sha256(data).hexdigest()}"'
+
+
+def static_file_response(request: Request, path, media_type: str, base64_encoded: bool = False, max_age: int = 86400) -> Response:
+    """
+    Serves a file that ships with the app. It is read (and decoded) once per process
+    and sent with a public Cache-Control, so clients and nginx keep their copy.
+    """
+    data, etag = _load_static_file(path, base64_encoded)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
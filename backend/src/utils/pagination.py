@@ -0,0 +1,28 @@
+import base64
+import binascii
+import struct
+from typing import Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def encode_rank_cursor(rank: float, last_id: str) -> str:
+    # Cursor of a list ordered by (rank, _id), carries both of the last item
+    raw = struct.pack(">d", rank) + ObjectId(last_id).binary
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> Optional[Tuple[float, ObjectId]]:
+    """
+    Returns the (rank, ObjectId) stored in the cursor, None for an empty cursor.
+    Raises ValueError for a cursor that was not produced by encode_rank_cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        if len(raw) != 20:
+            raise ValueError("Invalid cursor")
+        return struct.unpack(">d", raw[:8])[0], ObjectId(raw[8:])
+    except (binascii.Error, InvalidId, TypeError, ValueError, struct.error) as e:
+        raise ValueError("Invalid cursor") from e
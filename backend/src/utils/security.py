@@ -1,21 +1,28 @@
 import jwt
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
+from ..core.config import ACCESS_TOKEN_TTL
 
 # TODO: add this to the .env file
 SECRET_KEY = "my_secret_key_just_for_testing"  # Replace with your secure secret key
 ALGORITHM = "HS256"
 
 def create_access_token(user_id: str) -> str:
+    issued_at = datetime.utcnow()
     payload = {
         "sub": user_id,
-        "iat": datetime.utcnow()
+        "iat": issued_at,
+        "exp": issued_at + timedelta(seconds=ACCESS_TOKEN_TTL)
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def decode_access_token(token: str) -> Optional[str]:
+def decode_access_token_payload(token: str) -> Optional[dict]:
+    # Expired tokens are rejected, tokens issued before `exp` was added have none and stay valid
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.PyJWTError:
-        return None
\ No newline at end of file
+        return None
+
+def decode_access_token(token: str) -> Optional[str]:
+    payload = decode_access_token_payload(token)
+    return payload.get("sub") if payload else None
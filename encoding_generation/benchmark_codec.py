@@ -0,0 +1,51 @@
+"""
+Compares the scalar converters in design_mockups/iteration_1/japanese_decode.py
+with the vectorized batch codec in glyph_codec.py.
+
+Usage:
+    python benchmark_codec.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "design_mockups", "iteration_1"))
+from japanese_decode import number_to_japanese, japanese_to_number  # noqa: E402
+from glyph_codec import decode_batch, encode_batch  # noqa: E402
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'size':>9} | {'op':>6} | {'scalar codes/s':>14} | {'batch codes/s':>13} | {'speedup':>7}")
+    for size in args.sizes:
+        numbers = rng.integers(0, 2**64, size=size, dtype=np.uint64)
+        python_numbers = numbers.tolist()
+
+        scalar_codes, scalar_encode = timed(lambda: [number_to_japanese(n) for n in python_numbers])
+        batch_codes, batch_encode = timed(encode_batch, numbers)
+        assert batch_codes.tolist() == scalar_codes
+
+        scalar_values, scalar_decode = timed(lambda: [japanese_to_number(c) for c in scalar_codes])
+        (batch_values, valid), batch_decode = timed(decode_batch, batch_codes)
+        assert valid.all() and batch_values.tolist() == scalar_values
+
+        for op, scalar, batch in (("encode", scalar_encode, batch_encode), ("decode", scalar_decode, batch_decode)):
+            print(f"{size:>9} | {op:>6} | {size / scalar:>14,.0f} | {size / batch:>13,.0f} | {scalar / batch:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Vectorized codec for the 64-bit glyph encoding.
+
+A UID is split into 16 nibbles (most significant first) and every nibble is
+printed as one of 16 glyphs, the same mapping as
+design_mockups/iteration_1/japanese_decode.py. This module converts whole
+NumPy arrays at once: nibbles are extracted with shifts and masks and glyphs
+are looked up in tables, there is no per-number Python loop.
+
+Usage:
+    python glyph_codec.py encode numbers.txt -o codes.txt
+    python glyph_codec.py decode codes.txt -o numbers.txt
+"""
+import argparse
+import sys
+from itertools import islice
+
+import numpy as np
+
+# glyph index == nibble value, see design_mockups/iteration_1/encoding.txt
+GLYPHS = "日手目口木竹糸川山石火水刀土空月"
+CODE_LENGTH = 16
+
+_SHIFTS = np.arange(60, -4, -4, dtype=np.uint64)
+_GLYPH_CODEPOINTS = np.array([ord(glyph) for glyph in GLYPHS], dtype=np.uint32)
+
+# codepoint -> nibble, -1 for every character that is not a glyph
+_NIBBLE_LOOKUP = np.full(0x10000, -1, dtype=np.int8)
+_NIBBLE_LOOKUP[_GLYPH_CODEPOINTS] = np.arange(16, dtype=np.int8)
+
+
+def _as_uint64(numbers) -> np.ndarray:
+    if not isinstance(numbers, np.ndarray):
+        try:
+            numbers = np.array(numbers, dtype=np.uint64)
+        except (OverflowError, TypeError, ValueError) as e:
+            # negative or larger than 2^64 - 1 python ints
+            raise ValueError("Number out of range. Please provide a number between 0 and 2^64 - 1.") from e
+    elif numbers.dtype.kind == "i" and (numbers < 0).any():
+        raise ValueError("Number out of range. Please provide a number between 0 and 2^64 - 1.")
+    elif numbers.dtype.kind not in "iu":
+        raise TypeError(f"Expected an integer array, got {numbers.dtype}")
+    return numbers.astype(np.uint64, copy=False).ravel()
+
+
+def nibbles_batch(numbers) -> np.ndarray:
+    """
+    Splits integers in [0, 2^64) into their 16 nibbles, most significant first.
+    Returns a (len(numbers), 16) uint8 array of glyph indexes.
+    """
+    numbers = _as_uint64(numbers)
+    return ((numbers[:, None] >> _SHIFTS) & np.uint64(0xF)).astype(np.uint8)
+
+
+def encode_batch(numbers) -> np.ndarray:
+    """
+    Encodes integers in [0, 2^64) into glyph codes.
+    Returns an array of 16 character strings (dtype <U16).
+    """
+    codepoints = np.ascontiguousarray(_GLYPH_CODEPOINTS[nibbles_batch(numbers)])
+    # 16 UCS-4 codepoints per row are exactly one <U16 string
+    return codepoints.view(f"U{CODE_LENGTH}").ravel()
+
+
+def decode_batch(codes):
+    """
+    Decodes glyph codes back into integers.
+    Returns (values, valid): a uint64 array and a bool mask of the codes that
+    are exactly 16 known glyphs. Values of invalid codes are 0.
+    """
+    codes = np.asarray(codes)
+    if codes.dtype.kind != "U":
+        # one extra character to notice codes that are too long
+        codes = codes.astype(f"U{CODE_LENGTH + 1}")
+    codes = np.ascontiguousarray(codes.ravel())
+    width = codes.dtype.itemsize // 4
+    if width < CODE_LENGTH:
+        # every code is too short
+        codes = codes.astype(f"U{CODE_LENGTH}")
+        width = CODE_LENGTH
+    codepoints = codes.view(np.uint32).reshape(len(codes), width)
+
+    valid = codepoints[:, CODE_LENGTH - 1] != 0
+    if width > CODE_LENGTH:
+        valid &= codepoints[:, CODE_LENGTH] == 0
+    codepoints = codepoints[:, :CODE_LENGTH]
+    nibbles = np.where(codepoints < 0x10000, _NIBBLE_LOOKUP[np.minimum(codepoints, 0xFFFF)], -1)
+    valid &= (nibbles >= 0).all(axis=1)
+
+    nibbles = np.where(valid[:, None], nibbles, 0).astype(np.uint64)
+    values = np.bitwise_or.reduce(nibbles << _SHIFTS, axis=1)
+    return values, valid
+
+
+def validate_batch(codes) -> np.ndarray:
+    # Bool mask of the well formed codes
+    return decode_batch(codes)[1]
+
+
+def _batches(lines, batch_size: int):
+    lines = iter(lines)
+    while batch := [line.strip() for line in islice(lines, batch_size)]:
+        yield batch
+
+
+def encode_stream(lines, batch_size: int = 65536):
+    """
+    Encodes an iterable of decimal numbers (e.g. an open file) batch by batch,
+    so input of any size is processed with bounded memory. Yields arrays of codes.
+    """
+    for batch in _batches(lines, batch_size):
+        yield encode_batch([int(line) for line in batch])
+
+
+def decode_stream(lines, batch_size: int = 65536):
+    # Same as encode_stream for glyph codes, yields (values, valid) per batch
+    for batch in _batches(lines, batch_size):
+        yield decode_batch(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["encode", "decode"])
+    parser.add_argument("input", help="one number / code per line, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output file, - for stdout")
+    parser.add_argument("--batch-size", type=int, default=65536)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    invalid = 0
+    with source, target:
+        if args.command == "encode":
+            for codes in encode_stream(source, args.batch_size):
+                target.write("\n".join(codes.tolist()) + "\n")
+        else:
+            line_offset = 0
+            for values, valid in decode_stream(source, args.batch_size):
+                # invalid codes keep their line, empty so the output stays aligned with the input
+                lines = np.where(valid, values.astype(str), "")
+                target.write("\n".join(lines.tolist()) + "\n")
+                for index in np.flatnonzero(~valid):
+                    print(f"line {line_offset + index + 1}: invalid glyph code", file=sys.stderr)
+                invalid += int((~valid).sum())
+                line_offset += len(valid)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Offline batch recognition of glyph codes in photos, using the same recognizer
+as the backend (backend/src/services/glyph_recognition.py).
+
+Recognize photos, one code per image, prints "path<TAB>uid<TAB>code<TAB>confidence":
+    python recognize_codes.py photos/*.jpg
+
+Labeled accuracy: a CSV with "filename,uid" lines, filenames relative to the CSV:
+    python recognize_codes.py --labels photos/labels.csv
+
+Labeled accuracy and latency on synthetic photos rendered with render_mockups.py:
+    python recognize_codes.py --synthetic 500 --batch-size 32
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "backend", "src", "services"))
+from glyph_recognition import GlyphRecognizer  # noqa: E402
+from glyph_codec import nibbles_batch  # noqa: E402
+from render_mockups import render_code  # noqa: E402
+
+TEMPLATES_DIR = os.path.join(BASE_DIR, "characters_imgs", "done")
+
+
+def synthetic_photo(uid: int, rng: np.random.Generator, source: str) -> Image.Image:
+    """
+    A printed code as a phone camera would see it: random scale, slight rotation,
+    uneven gray paper, blur, sensor noise and JPEG compression.
+    """
+    tile = render_code(nibbles_batch([uid])[0], int(rng.integers(32, 96)), 8, 8, source)
+    margin = int(tile.width * rng.uniform(0.05, 0.2))
+    paper = Image.new("L", (tile.width + 2 * margin, tile.height + 2 * margin), 255)
+    paper.paste(tile, (margin, margin))
+    paper = paper.rotate(float(rng.uniform(-2, 2)), resample=Image.BILINEAR, expand=True, fillcolor=255)
+    paper = paper.filter(ImageFilter.GaussianBlur(float(rng.uniform(0, 1.2))))
+
+    pixels = np.asarray(paper, dtype=np.float32)
+    shading = np.linspace(rng.uniform(0.7, 0.9), rng.uniform(0.85, 1.0), pixels.shape[1], dtype=np.float32)
+    pixels = pixels * shading + rng.normal(0, 8, pixels.shape) + 20
+    photo = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    buffer = BytesIO()
+    photo.convert("RGB").save(buffer, "JPEG", quality=int(rng.integers(60, 95)))
+    return Image.open(BytesIO(buffer.getvalue()))
+
+
+def read_labels(path: str):
+    folder = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as file:
+        return [(os.path.join(folder, name), int(uid)) for name, uid in csv.reader(file) if name]
+
+
+def evaluate(recognizer: GlyphRecognizer, images, labels, batch_size: int):
+    """
+    Runs the recognizer over labeled images in batches.
+    Returns (code accuracy, glyph accuracy, per-image latencies in seconds).
+    """
+    correct_codes, correct_glyphs, latencies = 0, 0, []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        began = time.perf_counter()
+        results = recognizer.recognize_batch(batch)
+        latencies.extend([(time.perf_counter() - began) / len(batch)] * len(batch))
+
+        expected = nibbles_batch(labels[start:start + batch_size])
+        for result, nibbles in zip(results, expected):
+            if isinstance(result, Exception):
+                continue
+            correct_codes += int(np.array_equal(result["nibbles"], nibbles))
+            correct_glyphs += int((np.array(result["nibbles"]) == nibbles).sum())
+    total = max(len(images), 1)
+    return correct_codes / total, correct_glyphs / (16 * total), np.array(latencies)
+
+
+def report(recognizer: GlyphRecognizer, images, labels, batch_size: int):
+    code_accuracy, glyph_accuracy, latencies = evaluate(recognizer, images, labels, batch_size)
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    print(f"images: {len(images)}, batch size: {batch_size}")
+    print(f"code accuracy:  {code_accuracy:.2%}")
+    print(f"glyph accuracy: {glyph_accuracy:.2%}")
+    print(f"latency per image: p50 {p50:.2f} ms, p95 {p95:.2f} ms "
+          f"({len(images) / latencies.sum():,.0f} images/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="photos with one code each")
+    parser.add_argument("--labels", help="CSV with filename,uid lines")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="benchmark on N generated photos")
+    parser.add_argument("--source", choices=["svg", "jpeg"], default="svg", help="glyphs of the synthetic photos")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--templates", default=TEMPLATES_DIR, help="reference glyph images")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    recognizer = GlyphRecognizer(args.templates)
+    print(f"template bank: {recognizer.templates.shape[0]} templates in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        labels = rng.integers(0, 2 ** 64, size=args.synthetic, dtype=np.uint64)
+        images = [synthetic_photo(int(uid), rng, args.source) for uid in labels]
+        report(recognizer, images, labels, args.batch_size)
+        return 0
+
+    if args.labels:
+        paths, labels = zip(*read_labels(args.labels))
+        images = [Image.open(path) for path in paths]
+        report(recognizer, images, np.array(labels, dtype=np.uint64), args.batch_size)
+        return 0
+
+    if not args.images:
+        parser.error("no images given")
+    failed = 0
+    for start in range(0, len(args.images), args.batch_size):
+        paths = args.images[start:start + args.batch_size]
+        for path, result in zip(paths, recognizer.recognize_batch([Image.open(path) for path in paths])):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{path}: {result}", file=sys.stderr)
+            else:
+                print(f"{path}\t{result['uid']}\t{result['code']}\t{result['confidence']:.3f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Batch renderer for printable glyph-code sheets.
+
+Every UID is split into 16 nibbles (glyph_codec.nibbles_batch) and each nibble
+is drawn with one of the 16 symbol glyphs from characters/ (SVG) or
+characters_imgs/done/ (scanned JPEG). Codes are laid out as tiles on A4 sheets
+that are rendered in a process pool, each worker parses every glyph only once.
+
+Usage:
+    python render_mockups.py --range 1000 5000 -o generated_mockups/print_run
+    python render_mockups.py --uids uids.txt --format pdf --workers 8
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from xml.etree import ElementTree
+
+import numpy as np
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from glyph_codec import nibbles_batch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# glyph order (index == nibble value) and file names are shared with the backend recognizer
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "backend", "src", "services"))
+from glyph_recognition import GLYPH_NAMES, JPEG_NAMES  # noqa: E402
+
+SVG_DIR = os.path.join(BASE_DIR, "characters")
+JPEG_DIR = os.path.join(BASE_DIR, "characters_imgs", "done")
+
+# A4 at 300 DPI
+SHEET_SIZE = (2480, 3508)
+SHEET_MARGIN = 120
+
+_PATH_TOKEN_RE = re.compile(r"[MmLlHhVvCcZz]|-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_TRANSFORM_RE = re.compile(r"(translate|scale)\(([^)]*)\)")
+_CURVE_STEPS = 8
+
+
+def _cubic(p0, p1, p2, p3, steps=_CURVE_STEPS):
+    t = np.linspace(0, 1, steps + 1)[1:, None]
+    return ((1 - t) ** 3) * p0 + 3 * ((1 - t) ** 2) * t * p1 + 3 * (1 - t) * (t ** 2) * p2 + (t ** 3) * p3
+
+
+def parse_svg_path(d: str):
+    """
+    Flattens an SVG path (M, L, H, V, C and Z, absolute or relative, as written
+    by potrace) into a list of closed polygons, cubic curves become line segments.
+    """
+    tokens = _PATH_TOKEN_RE.findall(d)
+    polygons, current = [], []
+    position = np.zeros(2)
+    start = np.zeros(2)
+    command = None
+    i = 0
+
+    def numbers(count):
+        nonlocal i
+        values = [float(value) for value in tokens[i:i + count]]
+        i += count
+        return values
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                if current:
+                    polygons.append(np.array(current))
+                current = []
+                position = start.copy()
+                continue
+        relative = command.islower()
+        origin = position if relative else np.zeros(2)
+        upper = command.upper()
+        if upper == "M":
+            if current:
+                polygons.append(np.array(current))
+            position = origin + numbers(2)
+            start = position.copy()
+            current = [position]
+            # further coordinate pairs are implicit line-tos
+            command = "l" if relative else "L"
+        elif upper == "L":
+            position = origin + numbers(2)
+            current.append(position)
+        elif upper == "H":
+            position = np.array([(origin[0] if relative else 0) + numbers(1)[0], position[1]])
+            current.append(position)
+        elif upper == "V":
+            position = np.array([position[0], (origin[1] if relative else 0) + numbers(1)[0]])
+            current.append(position)
+        elif upper == "C":
+            x1, y1, x2, y2, x, y = numbers(6)
+            control1, control2, end = origin + (x1, y1), origin + (x2, y2), origin + (x, y)
+            current.extend(_cubic(position, control1, control2, end))
+            position = end
+        else:
+            raise ValueError(f"Unsupported path command {command}")
+    if current:
+        polygons.append(np.array(current))
+    return polygons
+
+
+def _parse_transform(transform: str):
+    # Returns (scale, translate) of a "translate(...) scale(...)" attribute
+    scale, translate = np.ones(2), np.zeros(2)
+    for name, args in _TRANSFORM_RE.findall(transform or ""):
+        values = [float(value) for value in re.split(r"[\s,]+", args.strip())]
+        if name == "translate":
+            translate = translate + scale * np.array(values + [0.0] * (2 - len(values)))
+        else:
+            scale = scale * np.array(values if len(values) == 2 else values * 2)
+    return scale, translate
+
+
+@lru_cache(maxsize=None)
+def load_svg_glyph(name: str):
+    """
+    Parses characters/<name>.svg into polygons normalized to its viewBox,
+    coordinates in [0, 1]. Cached, so every process parses a glyph once.
+    """
+    tree = ElementTree.parse(os.path.join(SVG_DIR, f"{name}.svg"))
+    root = tree.getroot()
+    _, _, width, height = (float(value) for value in root.get("viewBox").split())
+    polygons = []
+    for group in root.iter("{http://www.w3.org/2000/svg}g"):
+        scale, translate = _parse_transform(group.get("transform"))
+        for path in group.iter("{http://www.w3.org/2000/svg}path"):
+            for polygon in parse_svg_path(path.get("d")):
+                polygons.append((polygon * scale + translate) / (width, height))
+    return polygons, width / height
+
+
+@lru_cache(maxsize=None)
+def load_jpeg_glyph(name: str):
+    # Scanned glyph as a mask (glyph = 255), dark strokes on a light background
+    path = os.path.join(JPEG_DIR, f"{JPEG_NAMES.get(name, name)}.jpeg")
+    with Image.open(path) as image:
+        gray = image.convert("L")
+    return gray.point(lambda value: 255 if value < 100 else 0)
+
+
+@lru_cache(maxsize=None)
+def glyph_mask(index: int, size: int, source: str = "svg") -> Image.Image:
+    """
+    The glyph for nibble `index` rasterized into a size x size mask, aspect ratio
+    kept. Subpaths are combined with the even-odd rule, so holes stay open.
+    """
+    name = GLYPH_NAMES[index]
+    mask = Image.new("1", (size, size), 0)
+    if source == "jpeg":
+        glyph = load_jpeg_glyph(name).copy()
+        glyph.thumbnail((size, size))
+        offset = ((size - glyph.width) // 2, (size - glyph.height) // 2)
+        mask.paste(glyph.convert("1"), offset)
+        return mask
+
+    polygons, aspect = load_svg_glyph(name)
+    width, height = (size, size / aspect) if aspect >= 1 else (size * aspect, size)
+    offset = np.array([(size - width) / 2, (size - height) / 2])
+    for polygon in polygons:
+        layer = Image.new("1", (size, size), 0)
+        points = polygon * (width, height) + offset
+        ImageDraw.Draw(layer).polygon([tuple(point) for point in points], fill=1)
+        mask = ImageChops.logical_xor(mask, layer)
+    return mask
+
+
+def render_code(nibbles, glyph_size: int, columns: int, padding: int, source: str) -> Image.Image:
+    # One code as a grid of glyphs, black on white
+    rows = -(-len(nibbles) // columns)
+    step = glyph_size + padding
+    tile = Image.new("L", (columns * step - padding, rows * step - padding), 255)
+    for position, nibble in enumerate(nibbles):
+        row, column = divmod(position, columns)
+        tile.paste(0, (column * step, row * step), glyph_mask(int(nibble), glyph_size, source))
+    return tile
+
+
+def render_sheet(job):
+    """
+    Renders one sheet of codes and saves it, runs in a worker process.
+    Returns the path and the number of codes on the sheet.
+    """
+    uids, output_path, options = job
+    glyph_size, columns, padding, source = (
+        options["glyph_size"], options["columns"], options["padding"], options["source"]
+    )
+    font = ImageFont.load_default()
+    sheet = Image.new("L", SHEET_SIZE, 255)
+    draw = ImageDraw.Draw(sheet)
+
+    tile_width = columns * (glyph_size + padding) - padding
+    tile_height = -(-16 // columns) * (glyph_size + padding) - padding + options["caption_height"]
+    gap = options["tile_gap"]
+    per_row = max(1, (SHEET_SIZE[0] - 2 * SHEET_MARGIN + gap) // (tile_width + gap))
+
+    for position, (uid, nibbles) in enumerate(zip(uids, nibbles_batch(uids))):
+        row, column = divmod(position, per_row)
+        x = SHEET_MARGIN + column * (tile_width + gap)
+        y = SHEET_MARGIN + row * (tile_height + gap)
+        sheet.paste(render_code(nibbles, glyph_size, columns, padding, source), (x, y))
+        draw.text((x, y + tile_height - options["caption_height"] + 8), str(uid), fill=0, font=font)
+
+    sheet.save(output_path, resolution=300)
+    return output_path, len(uids)
+
+
+def sheet_capacity(glyph_size: int, columns: int, padding: int, caption_height: int, tile_gap: int) -> int:
+    tile_width = columns * (glyph_size + padding) - padding
+    tile_height = -(-16 // columns) * (glyph_size + padding) - padding + caption_height
+    per_row = max(1, (SHEET_SIZE[0] - 2 * SHEET_MARGIN + tile_gap) // (tile_width + tile_gap))
+    per_column = max(1, (SHEET_SIZE[1] - 2 * SHEET_MARGIN + tile_gap) // (tile_height + tile_gap))
+    return per_row * per_column
+
+
+def _warm_up(source: str, glyph_size: int):
+    # Worker initializer: parse and rasterize every glyph before the first sheet
+    for index in range(len(GLYPH_NAMES)):
+        glyph_mask(index, glyph_size, source)
+
+
+def render_codes(uids, output_dir: str, image_format: str = "png", workers: int = None,
+                 glyph_size: int = 48, columns: int = 8, padding: int = 8, source: str = "svg"):
+    """
+    Renders all `uids` into sheets in `output_dir` using a process pool.
+    Returns (sheet paths, elapsed seconds).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    options = {
+        "glyph_size": glyph_size, "columns": columns, "padding": padding, "source": source,
+        "caption_height": 40, "tile_gap": 60,
+    }
+    per_sheet = sheet_capacity(glyph_size, columns, padding, options["caption_height"], options["tile_gap"])
+    uids = np.asarray(uids, dtype=np.uint64)
+    jobs = [
+        (uids[start:start + per_sheet], os.path.join(output_dir, f"sheet_{start // per_sheet:05d}.{image_format}"), options)
+        for start in range(0, len(uids), per_sheet)
+    ]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_up, initargs=(source, glyph_size)) as pool:
+        paths = [path for path, _ in pool.map(render_sheet, jobs)]
+    return paths, time.perf_counter() - start
+
+
+def read_uids(path: str):
+    with open(path, encoding="utf-8") as file:
+        return [int(line) for line in file if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    uids = parser.add_mutually_exclusive_group(required=True)
+    uids.add_argument("--uids", help="file with one UID per line")
+    uids.add_argument("--range", type=int, nargs=2, metavar=("START", "STOP"), help="UIDs START..STOP-1")
+    parser.add_argument("-o", "--output-dir", default=os.path.join(BASE_DIR, "generated_mockups", "print_run"))
+    parser.add_argument("--format", choices=["png", "pdf"], default="png")
+    parser.add_argument("--workers", type=int, default=None, help="processes, defaults to the number of CPUs")
+    parser.add_argument("--glyph-size", type=int, default=48, help="glyph size in pixels at 300 DPI")
+    parser.add_argument("--columns", type=int, default=8, help="glyphs per row of one code")
+    parser.add_argument("--source", choices=["svg", "jpeg"], default="svg", help="vector glyphs or scanned images")
+    args = parser.parse_args()
+
+    uids = read_uids(args.uids) if args.uids else list(range(*args.range))
+    paths, elapsed = render_codes(
+        uids, args.output_dir, args.format, args.workers,
+        glyph_size=args.glyph_size, columns=args.columns, source=args.source,
+    )
+    print(f"Rendered {len(uids)} codes on {len(paths)} sheets in {elapsed:.2f}s "
+          f"({len(uids) / elapsed:,.0f} codes/s) into {args.output_dir}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Conversions of uploaded animation assets, run in the worker processes.
+
+Every converter takes the path of the source file, a directory for its outputs
+and a `report(progress)` callback (0-100), and returns the produced files as
+{output name: (path, content type)}.
+"""
+import os
+import struct
+import subprocess
+import zipfile
+from io import BytesIO
+
+from PIL import Image, ImageSequence
+
+# USDZ packages must be uncompressed zips with every file's data 64-byte aligned
+USDZ_ALIGNMENT = 64
+USD_LAYER_EXTENSIONS = (".usdc", ".usda", ".usd")
+# Id of the zip extra field used only for padding, ignored by readers
+PADDING_EXTRA_ID = 0x1986
+
+POSTER_MAX_EDGE = 1024
+
+
+def detect_kind(path: str):
+    """
+    Sniffs the kind of conversion a file needs from its first bytes:
+    "gif", "video" (MP4 / QuickTime), "usdz" or None when there is nothing to do.
+    """
+    with open(path, "rb") as file:
+        head = file.read(12)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[4:8] == b"ftyp":
+        return "video"
+    if head[:4] == b"PK\x03\x04":
+        with zipfile.ZipFile(path) as package:
+            if any(name.endswith(USD_LAYER_EXTENSIONS) for name in package.namelist()):
+                return "usdz"
+    return None
+
+
+def save_poster(image: Image.Image, output_dir: str) -> str:
+    image = image.convert("RGB")
+    image.thumbnail((POSTER_MAX_EDGE, POSTER_MAX_EDGE), Image.LANCZOS)
+    path = os.path.join(output_dir, "poster.jpg")
+    image.save(path, "JPEG", quality=85)
+    return path
+
+
+def gif_duration(path: str) -> float:
+    # Seconds of one loop, frames without a duration count as 100 ms like in browsers
+    with Image.open(path) as image:
+        return sum(frame.info.get("duration") or 100 for frame in ImageSequence.Iterator(image)) / 1000
+
+
+def run_ffmpeg(arguments, duration: float, report):
+    """
+    Runs ffmpeg with machine readable progress on stdout and reports the
+    share of `duration` (seconds) already written.
+    """
+    process = subprocess.Popen(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-progress", "pipe:1", *arguments],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and value.isdigit() and duration:
+            report(min(99, int(int(value) / 1e6 / duration * 100)))
+    _, errors = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {errors.strip()[-500:]}")
+
+
+def convert_gif(path: str, output_dir: str, report):
+    # H.264 MP4 that AVQueuePlayer can loop, plus the first frame as the poster
+    with Image.open(path) as image:
+        poster = save_poster(image, output_dir)
+    report(5)
+
+    video = os.path.join(output_dir, "video.mp4")
+    run_ffmpeg([
+        "-f", "gif", "-i", path,
+        "-movflags", "+faststart", "-pix_fmt", "yuv420p", "-c:v", "libx264", "-preset", "veryfast",
+        # yuv420p needs even dimensions
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        video,
+    ], gif_duration(path), report)
+    return {"video": (video, "video/mp4"), "poster": (poster, "image/jpeg")}
+
+
+def convert_video(path: str, output_dir: str, report):
+    # Videos are played as uploaded, only the poster frame is extracted
+    poster = os.path.join(output_dir, "poster.jpg")
+    run_ffmpeg(["-i", path, "-frames:v", "1", "-vf", f"scale='min({POSTER_MAX_EDGE},iw)':-2", poster], 0, report)
+    return {"poster": (poster, "image/jpeg")}
+
+
+def _padding_extra(offset: int, name: bytes) -> bytes:
+    # Extra field that moves the data of a local file header to the next aligned offset
+    data_offset = offset + 30 + len(name)
+    padding = -(data_offset + 4) % USDZ_ALIGNMENT
+    return struct.pack("<HH", PADDING_EXTRA_ID, padding) + b"\0" * padding
+
+
+def normalize_usdz(path: str, output_dir: str, report):
+    """
+    Rewrites a USDZ package the way ARKit expects it: stored (uncompressed)
+    entries, the root USD layer first and the data of every file 64-byte aligned.
+    The first image in the package becomes the poster.
+    """
+    with zipfile.ZipFile(path) as package:
+        entries = [info for info in package.infolist() if not info.is_dir()]
+        layers = [info for info in entries if info.filename.endswith(USD_LAYER_EXTENSIONS)]
+        entries = layers[:1] + [info for info in entries if info not in layers[:1]]
+
+        output = os.path.join(output_dir, "model.usdz")
+        outputs = {}
+        with open(output, "wb") as file, zipfile.ZipFile(file, "w", zipfile.ZIP_STORED) as normalized:
+            for position, info in enumerate(entries):
+                data = package.read(info)
+                entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                entry.compress_type = zipfile.ZIP_STORED
+                entry.extra = _padding_extra(file.tell(), info.filename.encode("utf-8"))
+                normalized.writestr(entry, data)
+
+                if "poster" not in outputs and not info.filename.endswith(USD_LAYER_EXTENSIONS):
+                    try:
+                        with Image.open(BytesIO(data)) as image:
+                            outputs["poster"] = (save_poster(image, output_dir), "image/jpeg")
+                    except OSError:
+                        pass
+                report(int((position + 1) / len(entries) * 100))
+
+    outputs["model"] = (output, "model/vnd.usdz+zip")
+    return outputs
+
+
+CONVERTERS = {
+    "gif": convert_gif,
+    "video": convert_video,
+    "usdz": normalize_usdz,
+}